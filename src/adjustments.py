@@ -0,0 +1,56 @@
+# src/adjustments.py
+from PyQt5.QtCore import Qt
+from .tone import apply_lut_array, brightness_lut, compose_luts, contrast_lut
+from .hsv import shift_hsv_array
+from .operations import point_operation
+
+DEFAULT_VALUES = {"brightness": 0, "contrast": 0, "hue": 0}
+
+def render_adjustments(source, brightness=0, contrast=0, hue=0, progress=None):
+    """Return an image in the working format with brightness, contrast and hue applied to source in one pass.
+
+    source itself is returned when every value is neutral.
+    """
+    if (brightness, contrast, hue) == (0, 0, 0):
+        return source
+    lut = compose_luts(brightness_lut(brightness), contrast_lut(contrast))
+    if hue:
+        return point_operation(source, lambda pixels: shift_hsv_array(pixels, hue, lut=lut), progress)
+    return point_operation(source, lambda pixels: apply_lut_array(pixels, lut), progress)
+
+class AdjustmentLayer:
+    """Current slider values, always rendered from the unadjusted source image.
+
+    Every render starts again from source, so a value of 60 costs one pass
+    however many slider ticks it took to get there, and offsets never compound.
+    """
+    def __init__(self):
+        self.source = None  # SourceSnapshot of the unadjusted image, shared with the slider commands
+        self.run = None  # Identifies the run of slider changes over source in recipes
+        self.values = dict(DEFAULT_VALUES)
+        self.proxy_key = None
+        self.proxy = None
+
+    def is_identity(self):
+        """True when every value is at its neutral setting."""
+        return self.values == DEFAULT_VALUES
+
+    def reset(self):
+        """Forget the source and return every value to neutral."""
+        self.source = None
+        self.run = None
+        self.values = dict(DEFAULT_VALUES)
+        self.proxy_key = None
+        self.proxy = None
+
+    def preview(self, source, values, size):
+        """Render values over a copy of source downscaled to size, for live feedback while dragging.
+
+        The downscaled copy is cached until source or size changes, so each
+        slider tick only processes about size's worth of pixels.
+        """
+        key = (source.cacheKey(), size.width(), size.height())
+        if key != self.proxy_key:
+            self.proxy = source.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            self.proxy_key = key
+        return render_adjustments(self.proxy, **values)
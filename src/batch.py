@@ -0,0 +1,151 @@
+# src/batch.py
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Batch runs never show a window
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtGui import QGuiApplication, QImage
+from . import pixels
+from .database import add_image_edits
+from .image_io import LARGE_IMAGE_PIXELS, probe_image
+from .recipes import RECIPE_VERSION, apply_recipe, load_recipe
+from .streaming import UnsupportedImage, can_stream, stream_recipe
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+def _crop_step(value):
+    x, y, width, height = (int(part) for part in value.split(","))
+    return {"op": "crop", "x": x, "y": y, "width": width, "height": height}
+
+# Each edit turns the text after "=" in NAME=VALUE, if any, into a recipe step
+EDITS = {
+    "brightness": lambda value: {"op": "brightness", "value": int(value)},
+    "contrast": lambda value: {"op": "contrast", "value": int(value)},
+    "hue": lambda value: {"op": "hue", "value": int(value)},
+    "sepia": lambda value: {"op": "sepia"},
+    "grayscale": lambda value: {"op": "grayscale"},
+    "rotate": lambda value: {"op": "rotate", "direction": value or "cw"},
+    "flip": lambda value: {"op": "flip", "axis": value or "horizontal"},
+    "crop": _crop_step,
+    "resize": lambda value: {"op": "resize"},
+}
+
+def parse_edit(text):
+    """Turn NAME[=VALUE] into a recipe step, checking the name and value."""
+    name, _, value = text.partition("=")
+    if name not in EDITS:
+        raise argparse.ArgumentTypeError(f"unknown edit '{name}', expected one of: {', '.join(EDITS)}")
+    try:
+        return EDITS[name](value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"bad value for {name}: '{value}'")
+
+def find_jobs(input_dir, output_dir, extension=None, force=False):
+    """Yield (source, target) paths for every image under input_dir whose output is missing or older.
+
+    An output_dir inside input_dir is skipped, so a later run never takes its own outputs as sources.
+    """
+    output = os.path.realpath(output_dir)
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = [name for name in dirs if os.path.realpath(os.path.join(root, name)) != output]
+        for file_name in sorted(files):
+            if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            source = os.path.join(root, file_name)
+            target = os.path.join(output_dir, os.path.relpath(source, input_dir))
+            if extension:
+                target = os.path.splitext(target)[0] + "." + extension.lstrip(".")
+            if not force and os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+                continue
+            yield source, target
+
+def _start_worker():
+    # Processes already use every core, so each one runs its bands on a single thread
+    pixels.BAND_THREADS = 1
+    global _app
+    _app = QGuiApplication.instance() or QGuiApplication([])
+
+def process_file(source, target, recipe, stream=False):
+    """Edit one file; return (source, megapixels, seconds, error message or None).
+
+    BMPs and PNGs too large to hold comfortably, or every one with stream, are
+    processed strip by strip when the recipe allows it. Variants the strip
+    readers do not handle are decoded whole instead.
+    """
+    started = time.perf_counter()
+    info = probe_image(source)
+    if info is not None and can_stream(source, target, recipe) and (
+            stream or info.size.width() * info.size.height() > LARGE_IMAGE_PIXELS):
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        try:
+            width, height = stream_recipe(source, target, recipe)
+        except UnsupportedImage:
+            pass
+        except (OSError, ValueError) as e:
+            return source, 0.0, time.perf_counter() - started, str(e)
+        else:
+            return source, width * height / 1e6, time.perf_counter() - started, None
+    image = QImage(source)
+    if image.isNull():
+        return source, 0.0, time.perf_counter() - started, "unable to open image"
+    megapixels = image.width() * image.height() / 1e6
+    result = apply_recipe(image, recipe)
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    if not result.save(target):
+        return source, megapixels, time.perf_counter() - started, "unable to save image"
+    return source, megapixels, time.perf_counter() - started, None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m src.batch",
+        description="Apply a chain of PicFix edits to every image in a directory tree.")
+    parser.add_argument("input_dir", help="directory to read images from, recursively")
+    parser.add_argument("output_dir", help="directory to write edited images to, mirroring input_dir")
+    parser.add_argument("-e", "--edit", dest="edits", action="append", type=parse_edit, default=[],
+                        metavar="NAME[=VALUE]",
+                        help="edit to apply, in order; repeat for a chain. One of: brightness=N, contrast=N, "
+                             "hue=DEGREES, sepia, grayscale, rotate=cw|ccw, flip=horizontal|vertical, "
+                             "crop=X,Y,W,H, resize")
+    parser.add_argument("-r", "--recipe", help="edit recipe saved from PicFix, applied before any --edit")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: one per core)")
+    parser.add_argument("-f", "--format", help="output file extension, e.g. png; default keeps the input's")
+    parser.add_argument("--force", action="store_true", help="rewrite outputs that are already up to date")
+    parser.add_argument("-u", "--user", help="record every output in this user's edit history")
+    parser.add_argument("--stream", action="store_true",
+                        help="process every BMP and PNG strip by strip when the edits allow it, not only huge ones")
+    args = parser.parse_args(argv)
+    steps = load_recipe(args.recipe)["steps"] if args.recipe else []
+    recipe = {"version": RECIPE_VERSION, "steps": steps + args.edits}
+
+    jobs = list(find_jobs(args.input_dir, args.output_dir, args.format, args.force))
+    print(f"{len(jobs)} image(s) to process with {args.jobs} worker(s)")
+    started = time.perf_counter()
+    total_megapixels = 0.0
+    failures = 0
+    targets = dict(jobs)
+    edits = []
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=_start_worker) as executor:
+        futures = [executor.submit(process_file, source, target, recipe, args.stream) for source, target in jobs]
+        for future in as_completed(futures):
+            source, megapixels, seconds, error = future.result()
+            if error:
+                failures += 1
+                print(f"{source}: {error}", file=sys.stderr)
+                continue
+            total_megapixels += megapixels
+            edits.append((targets[source], args.user))
+            print(f"{source}: {megapixels:.1f} MP in {seconds:.2f} s ({megapixels / max(seconds, 1e-9):.1f} MP/s)")
+    if args.user and edits:
+        add_image_edits(edits)
+    elapsed = time.perf_counter() - started
+    print(f"Done: {len(jobs) - failures} image(s), {total_megapixels:.1f} MP in {elapsed:.2f} s "
+          f"({total_megapixels / max(elapsed, 1e-9):.1f} MP/s), {failures} failed")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+# src/benchmark.py
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Benchmarks never show a window
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from PyQt5.QtCore import QRect, QT_VERSION_STR
+from PyQt5.QtGui import QImage
+from PyQt5.QtWidgets import QApplication
+from . import pixels
+from .commands import (AdjustmentCommand, CropCommand, FlipCommand, GrayscaleCommand, HueCommand,
+                       ResizeCommand, RGBCommand, RotateCommand, SepiaCommand)
+from .telemetry import TelemetryRecorder
+
+BENCHMARK_VERSION = 1
+DEFAULT_SIZES = (1, 4, 16, 100)
+DEFAULT_REPEATS = 3
+DEFAULT_THRESHOLD = 10.0
+
+def synthetic_image(megapixels):
+    """Return a deterministic 4:3 RGB32 image of about megapixels, with gradients and noise."""
+    width = max(1, round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = max(1, round(megapixels * 1e6 / width))
+    image = QImage(width, height, QImage.Format_RGB32)
+    data = pixels.image_array(image)
+    noise = np.random.default_rng(0).integers(0, 32, size=width, dtype=np.uint8)
+    for start, stop in pixels.row_chunks(height, width):
+        rows = np.arange(start, stop, dtype=np.uint32)[:, None]
+        columns = np.arange(width, dtype=np.uint32)[None, :]
+        data[start:stop, :, pixels.RED] = (columns * 255 // width).astype(np.uint8)
+        data[start:stop, :, pixels.GREEN] = (rows * 255 // height).astype(np.uint8)
+        data[start:stop, :, pixels.BLUE] = ((rows + columns) & 0xFF).astype(np.uint8) ^ noise
+        data[start:stop, :, pixels.ALPHA] = 255
+    return image
+
+def _center_rect(image):
+    return QRect(image.width() // 4, image.height() // 4, image.width() // 2, image.height() // 2)
+
+def _command(make):
+    """A case that runs the command make(window) through the window's command queue."""
+    return lambda window: lambda: window.executeCommand(make(window))
+
+def _undo_case(window):
+    window.executeCommand(SepiaCommand(window.image_label))
+    _wait(window)
+    return window.undo
+
+def _redo_case(window):
+    _undo_case(window)()
+    return window.redo
+
+# Each case sets up the window, untimed, and returns the callable to time
+CASES = {
+    "brightness": _command(lambda window: AdjustmentCommand(window.image_label, "brightness", 40)),
+    "contrast": _command(lambda window: AdjustmentCommand(window.image_label, "contrast", 40)),
+    "hue": _command(lambda window: HueCommand(window.image_label, 30)),
+    "sepia": _command(lambda window: SepiaCommand(window.image_label)),
+    "gray": _command(lambda window: GrayscaleCommand(window.image_label)),
+    "rgb": _command(lambda window: RGBCommand(window.image_label)),
+    "rotate": _command(lambda window: RotateCommand(window.image_label, "cw")),
+    "flip": _command(lambda window: FlipCommand(window.image_label, "horizontal")),
+    "resize": _command(lambda window: ResizeCommand(window.image_label)),
+    "crop": _command(lambda window: CropCommand(window.image_label, _center_rect(window.image_label.image))),
+    "zoom": lambda window: lambda: window.zoomOnImage(1.25),
+    "undo": _undo_case,
+    "redo": _redo_case,
+}
+
+def _wait(window):
+    """Process events until the window's command queue is empty."""
+    app = QApplication.instance()
+    while window.isBusy():
+        app.processEvents()
+    app.processEvents()
+
+def _start_worker():
+    global _app
+    _app = QApplication.instance() or QApplication([])
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def run_case(name, megapixels, repeats):
+    """Time one case on a fresh editor window; runs in a process of its own so peak RSS is per case."""
+    from .gui import PhotoEditorGUI
+    window = PhotoEditorGUI("benchmark", telemetry=TelemetryRecorder("benchmark", write=None))
+    original = synthetic_image(megapixels)
+    actual = original.width() * original.height() / 1e6
+    rss_before = _peak_rss_mb()
+    times = []
+    for _ in range(repeats):
+        window.image_label.original_image = original
+        window.image_label.adjustments.reset()
+        window.undo_stack.clear()
+        window.redo_stack.clear()
+        window.zoom_factor = 1
+        window.image_label.showImage(original)
+        _wait(window)
+        timed = CASES[name](window)
+        started = time.perf_counter()
+        timed()
+        _wait(window)
+        times.append(time.perf_counter() - started)
+    seconds = statistics.median(times)
+    peak = _peak_rss_mb()
+    return {"case": name, "megapixels": megapixels, "width": original.width(), "height": original.height(),
+            "seconds": seconds, "min_seconds": min(times), "mp_per_s": actual / max(seconds, 1e-9), "peak_rss_mb": peak, "rss_growth_mb": peak - rss_before}
+
+def run(cases, sizes, repeats):
+    """Run every case at every size, each in a new process, and return the results document."""
+    results = []
+    # One task per process: peak RSS is measured on a clean process every time
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1, initializer=_start_worker) as executor:
+        for megapixels in sizes:
+            for name in cases:
+                result = executor.submit(run_case, name, megapixels, repeats).result()
+                print(f"{name:>10} {result['megapixels']:7g} MP  {result['seconds'] * 1000:9.1f} ms  "
+                      f"{result['mp_per_s']:8.1f} MP/s  peak {result['peak_rss_mb']:7.0f} MB")
+                results.append(result)
+    return {"version": BENCHMARK_VERSION,
+            "environment": {"python": platform.python_version(), "qt": QT_VERSION_STR,
+                            "platform": platform.platform(), "cpus": os.cpu_count(),
+                            "band_threads": pixels.BAND_THREADS},
+            "repeats": repeats, "results": results}
+
+def compare(baseline, current, threshold):
+    """Return (case, megapixels, metric, old, new) for every time or peak RSS more than threshold % worse."""
+    old = {(result["case"], result["megapixels"]): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        previous = old.get((result["case"], result["megapixels"]))
+        if previous is None:
+            continue
+        for metric in ("seconds", "peak_rss_mb"):
+            if result[metric] > previous[metric] * (1 + threshold / 100):
+                regressions.append((result["case"], result["megapixels"], metric, previous[metric], result[metric]))
+    return regressions
+
+def _sizes(text):
+    try:
+        return [float(size) for size in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"bad sizes '{text}', expected megapixels like 1,4,16")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.benchmark",
+                                     description="Benchmark PicFix operations on synthetic images.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks and save the results as JSON")
+    run_parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    run_parser.add_argument("-s", "--sizes", type=_sizes, default=list(DEFAULT_SIZES),
+                            help="comma-separated image sizes in megapixels (default: 1,4,16,100)")
+    run_parser.add_argument("-c", "--case", dest="cases", action="append", choices=list(CASES),
+                            help="case to run; repeat for several (default: all)")
+    run_parser.add_argument("-n", "--repeats", type=int, default=DEFAULT_REPEATS,
+                            help="timed runs per case; the median is recorded (default: 3)")
+    compare_parser = commands.add_parser("compare", help="flag regressions of a run against a baseline")
+    compare_parser.add_argument("baseline", help="baseline results JSON")
+    compare_parser.add_argument("current", help="results JSON to check")
+    compare_parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="percentage slowdown or memory growth to flag (default: 10)")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        document = run(args.cases or list(CASES), args.sizes, args.repeats)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(document, f, indent=2)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    for name, megapixels, metric, old, new in regressions:
+        print(f"REGRESSION {name} at {megapixels} MP: {metric} {old:.3f} -> {new:.3f} "
+              f"(+{(new / old - 1) * 100:.0f}%)")
+    print(f"{len(regressions)} regression(s) above {args.threshold:.0f}%")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
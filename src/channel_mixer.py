@@ -0,0 +1,66 @@
+# src/channel_mixer.py
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QGridLayout, QLabel,
+                             QComboBox, QDoubleSpinBox, QPushButton)
+from PyQt5.QtCore import Qt
+from .color_matrix import PRESETS, IDENTITY
+
+class ChannelMixerDialog(QDialog):
+    """Dialog for editing a 3x4 color matrix, starting from one of the presets."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Channel Mixer")
+        self.spin_boxes = []
+        self.setupUI()
+        self.setMatrix(IDENTITY)
+
+    def setupUI(self):
+        """Set up the preset selector and the matrix grid."""
+        layout = QVBoxLayout()
+
+        preset_layout = QHBoxLayout()
+        preset_layout.addWidget(QLabel("Preset:"))
+        self.preset_box = QComboBox()
+        self.preset_box.addItems(PRESETS.keys())
+        self.preset_box.activated[str].connect(lambda name: self.setMatrix(PRESETS[name]))
+        preset_layout.addWidget(self.preset_box)
+        layout.addLayout(preset_layout)
+
+        grid = QGridLayout()
+        for column, title in enumerate(("Red", "Green", "Blue", "Constant"), start=1):
+            grid.addWidget(QLabel(title), 0, column, Qt.AlignCenter)
+        for row, title in enumerate(("Red out", "Green out", "Blue out"), start=1):
+            grid.addWidget(QLabel(title), row, 0)
+            row_boxes = []
+            for column in range(4):
+                spin_box = QDoubleSpinBox()
+                if column < 3:
+                    spin_box.setRange(-2.0, 2.0)
+                    spin_box.setDecimals(3)
+                    spin_box.setSingleStep(0.05)
+                else:
+                    spin_box.setRange(-255, 255)
+                    spin_box.setDecimals(0)
+                grid.addWidget(spin_box, row, column + 1)
+                row_boxes.append(spin_box)
+            self.spin_boxes.append(row_boxes)
+        layout.addLayout(grid)
+
+        button_layout = QHBoxLayout()
+        apply_button = QPushButton("Apply")
+        apply_button.clicked.connect(self.accept)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.reject)
+        button_layout.addWidget(apply_button)
+        button_layout.addWidget(cancel_button)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def setMatrix(self, matrix):
+        """Show matrix in the grid."""
+        for row_boxes, row in zip(self.spin_boxes, matrix):
+            for spin_box, value in zip(row_boxes, row):
+                spin_box.setValue(value)
+
+    def getMatrix(self):
+        """Return the matrix currently entered in the grid."""
+        return tuple(tuple(spin_box.value() for spin_box in row_boxes) for row_boxes in self.spin_boxes)
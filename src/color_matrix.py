@@ -0,0 +1,56 @@
+# src/color_matrix.py
+import numpy as np
+from .pixels import BLUE, GREEN, RED, image_array, row_chunks
+
+# 3x4 affine color matrices: one row per output red, green and blue channel,
+# columns weight the input red, green and blue channels plus a constant offset
+IDENTITY = ((1, 0, 0, 0),
+            (0, 1, 0, 0),
+            (0, 0, 1, 0))
+SEPIA = ((0.393, 0.769, 0.189, 0),
+         (0.349, 0.686, 0.168, 0),
+         (0.272, 0.534, 0.131, 0))
+# Same weights as Qt's qGray(), so the result matches a grayscale format conversion
+GRAYSCALE = ((0.34375, 0.5, 0.15625, 0),
+             (0.34375, 0.5, 0.15625, 0),
+             (0.34375, 0.5, 0.15625, 0))
+SWAP_RED_BLUE = ((0, 0, 1, 0),
+                 (0, 1, 0, 0),
+                 (1, 0, 0, 0))
+
+PRESETS = {
+    "Identity": IDENTITY,
+    "Sepia": SEPIA,
+    "Grayscale": GRAYSCALE,
+    "Swap Red/Blue": SWAP_RED_BLUE,
+}
+
+def _channel_permutation(matrix):
+    """Return the source channel of each output if matrix only reorders channels, else None."""
+    linear, offset = matrix[:, :3], matrix[:, 3]
+    if offset.any() or not np.isin(linear, (0, 1)).all() or (linear.sum(axis=1) != 1).any():
+        return None
+    return linear.argmax(axis=1)
+
+def apply_color_matrix_array(pixels, matrix):
+    """Apply a 3x4 color matrix in place to a (height, width, 4) pixel array, saturating to 0-255."""
+    matrix = np.asarray(matrix, dtype=np.float32).reshape(3, 4)
+    channels = (RED, GREEN, BLUE)
+    permutation = _channel_permutation(matrix)
+    if permutation is not None:
+        # Pure channel swaps are just byte shuffles
+        pixels[..., list(channels)] = pixels[..., [channels[source] for source in permutation]]
+        return pixels
+    height, width = pixels.shape[:2]
+    for start, stop in row_chunks(height, width):
+        block = pixels[start:stop]
+        red, green, blue = (block[..., channel].astype(np.float32) for channel in channels)
+        for channel, (r, g, b, offset) in zip(channels, matrix):
+            # Assigning the clipped floats truncates them, like int() in the old per-pixel loop
+            block[..., channel] = np.clip(r * red + g * green + b * blue + offset, 0, 255)
+    return pixels
+
+def apply_color_matrix(image, matrix):
+    """Apply a 3x4 color matrix in place to a 32-bit QImage and return it."""
+    apply_color_matrix_array(image_array(image), matrix)
+    return image
@@ -1,8 +1,14 @@
 # src/commands.py
+import uuid
 from abc import ABC, abstractmethod
 from PyQt5.QtWidgets import QLabel, QRubberBand
 from PyQt5.QtCore import QRect, QSize
 from PyQt5.QtGui import QImage, QPixmap, QTransform
+from . import operations
+from .adjustments import render_adjustments
+from .pixels import image_array, working_format
+from .undo_store import UndoSnapshot, CropSnapshot, PatchSnapshot, SourceSnapshot
+from .recipes import apply_recipe
 
 class Command(ABC):
     """Abstract base class for commands."""
@@ -14,164 +20,345 @@ class Command(ABC):
     def undo(self):
         pass
 
-class BrightnessCommand(Command):
-    """Command for brightness changes."""
-    def __init__(self, image_label, value):
+    def recipeSteps(self):
+        """Recipe steps that redo this command's pixel edits; see recipes.py."""
+        return []
+
+class ImageCommand(Command):
+    """Base class for commands that replace the image with one computed from it.
+
+    begin() snapshots the image on the GUI thread and process() only reads
+    that snapshot, so process() can run on a worker thread while the window
+    stays responsive. packUndo() then trades the snapshot for the compressed
+    pixels undo needs, and finish() shows the result on the GUI thread.
+    """
+    def __init__(self, image_label):
         self.image_label = image_label
-        self.value = value
-        self.previous_image = image_label.image.copy()
+        self.previous_image = None
+        self.undo_snapshot = None
+
+    def begin(self):
+        """Snapshot the current image; QImage copies share pixels until written to."""
+        self.previous_image = self.image_label.image
+        return self.previous_image
+
+    @abstractmethod
+    def process(self, image, progress=None):
+        """Return the new image computed from image, calling progress(done, total) as it goes."""
+
+    def packUndo(self, image):
+        """Keep only what undo needs to get from image back to the snapshot."""
+        self.undo_snapshot = UndoSnapshot(self.previous_image, image)
+        self.previous_image = None
+
+    def finish(self, image):
+        """Show the processed image, repainting only what changedRect() says process() can have changed.
+
+        It may run before packUndo(), while the undo data is still being packed.
+        """
+        self.image_label.showImage(image, self.changedRect())
+
+    def changedRect(self):
+        """The part of the image process() can change, or None if all of it."""
+        return None
+
+    def supersedes(self, command):
+        """True if this command makes a pending or running command pointless."""
+        return False
+
+    def mergeWith(self, command):
+        """Absorb command, the previous undo step, into this one if they form one edit."""
+        return False
 
     def execute(self):
-        self.image_label.changeBrightness(self.value)
-        self.image_label.repaint()
+        image = self.process(self.begin())
+        self.packUndo(image)
+        self.finish(image)
 
     def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
+        self.image_label.showImage(self.undo_snapshot.restore(self.image_label.image),
+                                   self.undo_snapshot.changed_rect())
+        # Redo recomputes from the restored image, so the snapshot is no longer needed
+        self.undo_snapshot = None
+
+class RegionalCommand(ImageCommand):
+    """Base class for filters that work pixel by pixel, applied only inside the selection if there is one.
+
+    Subclasses implement filter() and recipeStep(). With a selection only its
+    pixels are processed, and undo keeps only the tiles under it. When
+    nothing else shares the current image's pixels, the filtered part is
+    written into them in place, so the edit costs only the selection's size.
+    """
+    def __init__(self, image_label):
+        super().__init__(image_label)
+        # Taken once, so redo and replay cover the same pixels whatever is selected later
+        self.region = image_label.selection()
+        self.in_place = False
+        # The part under the region before and after filtering; packUndo() takes the
+        # first on the worker while finish() takes the second on the GUI thread
+        self.patch_before = None
+        self.patch_after = None
+
+    @abstractmethod
+    def filter(self, image, progress=None):
+        """Return image with the filter applied everywhere."""
 
-class ContrastCommand(Command):
+    @abstractmethod
+    def recipeStep(self):
+        """The recipe step of the filter, without its region."""
+
+    def begin(self):
+        image = super().begin()
+        self.in_place = (not self.region.intersected(image.rect()).isEmpty()
+                         and image.format() == working_format(image) and image.isDetached())
+        return image
+
+    def process(self, image, progress=None):
+        # Only the run begin() prepared may patch in place; replays get a new image
+        in_place, self.in_place = self.in_place, False
+        if self.region.isEmpty():
+            return self.filter(image, progress)
+        if not in_place:
+            return operations.in_region(image, self.region, self.filter, progress)
+        self.patch_before = image.copy(self.region.intersected(image.rect()))
+        self.patch_after = self.filter(self.patch_before, progress).convertToFormat(image.format())
+        # The image itself is patched by finish(), on the GUI thread that paints it
+        return image
+
+    def packUndo(self, image):
+        if self.patch_before is not None:
+            before, self.patch_before = self.patch_before, None
+            self.undo_snapshot = PatchSnapshot(image, before, self.region.intersected(image.rect()))
+        else:
+            self.undo_snapshot = UndoSnapshot(self.previous_image, image, self.changedRect())
+        self.previous_image = None
+
+    def finish(self, image):
+        if self.patch_after is not None:
+            after, self.patch_after = self.patch_after, None
+            if not image.isDetached():
+                # Something took a share of the pixels after begin(), so they are copied after all
+                image = image.copy()
+            rect = self.region.intersected(image.rect())
+            image_array(image)[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1] = \
+                image_array(after, writable=False)
+        super().finish(image)
+
+    def changedRect(self):
+        return None if self.region.isEmpty() else self.region
+
+    def recipeSteps(self):
+        step = self.recipeStep()
+        if not self.region.isEmpty():
+            region = self.region
+            step["region"] = [region.x(), region.y(), region.width(), region.height()]
+        return [step]
+
+class BrightnessCommand(RegionalCommand):
+    """Command for brightness changes."""
+    def __init__(self, image_label, value):
+        super().__init__(image_label)
+        self.value = value
+
+    def filter(self, image, progress=None):
+        return operations.brightness(image, self.value, progress)
+
+    def recipeStep(self):
+        return {"op": "brightness", "value": self.value}
+
+class ContrastCommand(RegionalCommand):
     """Command for contrast changes."""
     def __init__(self, image_label, value):
-        self.image_label = image_label
+        super().__init__(image_label)
         self.value = value
-        self.previous_image = image_label.image.copy()
 
-    def execute(self):
-        self.image_label.changeContrast(self.value)
-        self.image_label.repaint()
+    def filter(self, image, progress=None):
+        return operations.contrast(image, self.value, progress)
+
+    def recipeStep(self):
+        return {"op": "contrast", "value": self.value}
+
+class AdjustmentCommand(ImageCommand):
+    """Command for slider adjustments, rendered once from the adjustment layer's source."""
+    def __init__(self, image_label, name, value):
+        super().__init__(image_label)
+        self.name = name
+        self.value = value
+        self.source = None
+        self.run = None
+        self.previous_values = None
+        self.values = None
+
+    def begin(self):
+        layer = self.image_label.adjustments
+        # The source is shared with the layer and the run's other commands, so no pixels are copied here
+        self.source = SourceSnapshot(self.image_label.image) if layer.source is None else layer.source
+        # Random rather than counted, so runs from a loaded recipe never match new ones
+        self.run = uuid.uuid4().hex if layer.source is None else layer.run
+        self.previous_values = dict(layer.values)
+        self.values = dict(layer.values)
+        self.values[self.name] = self.value
+        return super().begin()
+
+    def process(self, image, progress=None):
+        return render_adjustments(self.source.restore(), progress=progress, **self.values)
+
+    def packUndo(self, image):
+        # Undo re-renders the previous values from source, so no pixels are kept
+        self.previous_image = None
+
+    def finish(self, image):
+        self.image_label.setAdjustments(self.source, self.values, self.run)
+        super().finish(image)
+
+    def supersedes(self, command):
+        return isinstance(command, AdjustmentCommand) and command.name == self.name
+
+    def recipeSteps(self):
+        return [dict(self.values, op="adjust", run=self.run)]
+
+    def mergeWith(self, command):
+        # Consecutive changes of one slider over the same source are one undo step
+        if (isinstance(command, AdjustmentCommand) and command.name == self.name
+                and command.source.cacheKey() == self.source.cacheKey()):
+            self.previous_values = command.previous_values
+            return True
+        return False
 
     def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
+        self.image_label.setAdjustments(self.source, self.previous_values, self.run)
+        self.image_label.showImage(render_adjustments(self.source.restore(), **self.previous_values))
 
-class RotateCommand(Command):
+class RotateCommand(ImageCommand):
     """Command for rotation."""
     def __init__(self, image_label, direction):
-        self.image_label = image_label
+        super().__init__(image_label)
         self.direction = direction
-        self.previous_image = image_label.image.copy()
 
-    def execute(self):
-        self.image_label.rotateImage90(self.direction)
-        self.image_label.repaint()
+    def process(self, image, progress=None):
+        return operations.rotate90(image, self.direction, progress)
+
+    def recipeSteps(self):
+        return [{"op": "rotate", "direction": self.direction}]
+
+    def packUndo(self, image):
+        # A quarter turn is lossless, so undo just turns back
+        self.previous_image = None
 
     def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
+        inverse = "ccw" if self.direction == "cw" else "cw"
+        self.image_label.showImage(operations.rotate90(self.image_label.image, inverse))
 
-class FlipCommand(Command):
+class FlipCommand(ImageCommand):
     """Command for flipping."""
     def __init__(self, image_label, axis):
-        self.image_label = image_label
+        super().__init__(image_label)
         self.axis = axis
-        self.previous_image = image_label.image.copy()
 
-    def execute(self):
-        self.image_label.flipImage(self.axis)
-        self.image_label.repaint()
+    def process(self, image, progress=None):
+        return operations.flip(image, self.axis, progress)
+
+    def recipeSteps(self):
+        return [{"op": "flip", "axis": self.axis}]
+
+    def packUndo(self, image):
+        # Flipping is its own inverse
+        self.previous_image = None
 
     def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
+        self.image_label.showImage(operations.flip(self.image_label.image, self.axis))
 
-class GrayscaleCommand(Command):
+class GrayscaleCommand(RegionalCommand):
     """Command for grayscale conversion."""
-    def __init__(self, image_label):
-        self.image_label = image_label
-        self.previous_image = image_label.image.copy()
+    def filter(self, image, progress=None):
+        return operations.grayscale(image, progress)
 
-    def execute(self):
-        self.image_label.convertToGray()
-        self.image_label.repaint()
+    def recipeStep(self):
+        return {"op": "grayscale"}
 
-    def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
-
-class RGBCommand(Command):
+class RGBCommand(RegionalCommand):
     """Command for RGB conversion."""
-    def __init__(self, image_label):
-        self.image_label = image_label
-        self.previous_image = image_label.image.copy()
+    def filter(self, image, progress=None):
+        return operations.to_rgb(image, progress)
 
-    def execute(self):
-        self.image_label.convertToRGB()
-        self.image_label.repaint()
-
-    def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
+    def recipeStep(self):
+        return {"op": "rgb"}
 
-class SepiaCommand(Command):
+class SepiaCommand(RegionalCommand):
     """Command for sepia conversion."""
-    def __init__(self, image_label):
-        self.image_label = image_label
-        self.previous_image = image_label.image.copy()
+    def filter(self, image, progress=None):
+        return operations.sepia(image, progress)
 
-    def execute(self):
-        self.image_label.convertToSepia()
-        self.image_label.repaint()
+    def recipeStep(self):
+        return {"op": "sepia"}
 
-    def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
+class ChannelMixerCommand(RegionalCommand):
+    """Command for channel mixing."""
+    def __init__(self, image_label, matrix):
+        super().__init__(image_label)
+        self.matrix = matrix
+
+    def filter(self, image, progress=None):
+        return operations.mix_channels(image, self.matrix, progress)
+
+    def recipeStep(self):
+        return {"op": "mix", "matrix": [list(row) for row in self.matrix]}
 
-class CropCommand(Command):
+class CropCommand(ImageCommand):
     """Command for cropping."""
     def __init__(self, image_label, crop_rect):
-        self.image_label = image_label
+        super().__init__(image_label)
         self.crop_rect = crop_rect
-        self.previous_image = image_label.image.copy()
 
-    def execute(self):
+    def process(self, image, progress=None):
         if self.crop_rect.isValid():
-            cropped = self.image_label.image.copy(self.crop_rect)
-            self.image_label.image = QImage(cropped)
-            self.image_label.setPixmap(QPixmap().fromImage(cropped))
-            self.image_label.repaint()
+            return operations.crop(image, self.crop_rect, progress)
+        return image
 
-    def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
+    def recipeSteps(self):
+        if not self.crop_rect.isValid():
+            return []
+        rect = self.crop_rect
+        return [{"op": "crop", "x": rect.x(), "y": rect.y(), "width": rect.width(), "height": rect.height()}]
+
+    def packUndo(self, image):
+        if self.crop_rect.isValid():
+            self.undo_snapshot = CropSnapshot(self.previous_image, self.crop_rect)
+        else:
+            self.undo_snapshot = UndoSnapshot(self.previous_image, image)
+        self.previous_image = None
 
-class ResizeCommand(Command):
+class ResizeCommand(ImageCommand):
     """Command for resizing."""
-    def __init__(self, image_label):
-        self.image_label = image_label
-        self.previous_image = image_label.image.copy()
+    def process(self, image, progress=None):
+        return operations.resize_half(image, progress)
 
-    def execute(self):
-        self.image_label.resizeImage()
-        self.image_label.repaint()
+    def recipeSteps(self):
+        return [{"op": "resize"}]
 
-    def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
-
-class HueCommand(Command):
+class HueCommand(RegionalCommand):
     """Command for hue changes."""
     def __init__(self, image_label, hue_shift):
-        self.image_label = image_label
+        super().__init__(image_label)
         self.hue_shift = hue_shift
-        self.previous_image = image_label.image.copy()
 
-    def execute(self):
-        self.image_label.changeHue(self.hue_shift)
-        self.image_label.repaint()
+    def filter(self, image, progress=None):
+        return operations.hue(image, self.hue_shift, progress)
 
-    def undo(self):
-        self.image_label.image = self.previous_image.copy()
-        self.image_label.setPixmap(QPixmap().fromImage(self.image_label.image))
-        self.image_label.repaint()
+    def recipeStep(self):
+        return {"op": "hue", "value": self.hue_shift}
+
+class RecipeCommand(ImageCommand):
+    """Command for applying a saved edit recipe as one undo step."""
+    def __init__(self, image_label, recipe):
+        super().__init__(image_label)
+        self.recipe = recipe
+
+    def process(self, image, progress=None):
+        return apply_recipe(image, self.recipe, progress)
+
+    def recipeSteps(self):
+        return list(self.recipe["steps"])
 
 class ZoomCommand(Command):
     """Command for zoom changes."""
@@ -184,7 +371,7 @@ class ZoomCommand(Command):
 
     def execute(self):
         self.photo_editor.zoom_factor = self.new_zoom
-        self.image_label.resize(self.new_zoom * self.image_label.pixmap().size())
+        self.image_label.resize(self.new_zoom * self.image_label.image.size())
         if self.zoom_value != 1.0:  # Normal size doesn't adjust scrollbars
             self.photo_editor.adjustScrollBar(self.photo_editor.scroll_area.horizontalScrollBar(), self.zoom_value)
             self.photo_editor.adjustScrollBar(self.photo_editor.scroll_area.verticalScrollBar(), self.zoom_value)
@@ -192,9 +379,9 @@ class ZoomCommand(Command):
 
     def undo(self):
         self.photo_editor.zoom_factor = self.previous_zoom
-        self.image_label.resize(self.previous_zoom * self.image_label.pixmap().size())
+        self.image_label.resize(self.previous_zoom * self.image_label.image.size())
         if self.zoom_value != 1.0:  # Normal size doesn't adjust scrollbars
             inverse_zoom = 1.0 / self.zoom_value
             self.photo_editor.adjustScrollBar(self.photo_editor.scroll_area.horizontalScrollBar(), inverse_zoom)
             self.photo_editor.adjustScrollBar(self.photo_editor.scroll_area.verticalScrollBar(), inverse_zoom)
-        self.photo_editor.updateActions()
\ No newline at end of file
+        self.photo_editor.updateActions()
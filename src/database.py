@@ -2,109 +2,227 @@
 import sqlite3
 import hashlib
 import os
+import threading
+import time
 
 DATABASE_FILE = "photo_editor.db"
 
-def hash_password(password):
-    """Hash a password using SHA-256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+# Columns of the telemetry table, in the order add_telemetry_events expects them
+TELEMETRY_COLUMNS = ("username", "recorded_at", "command", "action", "width", "height", "seconds",
+                     "gui_seconds", "allocated_bytes", "undo_memory_bytes", "undo_disk_bytes", "rss_bytes")
 
-def init_database():
-    """Initialize the SQLite database with users and images tables."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    # Users table: stores username, hashed password, security question, hashed answer
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
+# Schema migrations, in order. The database's user_version is the number already applied,
+# so each one runs exactly once per database file.
+MIGRATIONS = [
+    # 1: users and images. IF NOT EXISTS adopts databases created before versioning.
+    [
+        # Users table: stores username, hashed password, security question, hashed answer
+        """CREATE TABLE IF NOT EXISTS users (
             username TEXT PRIMARY KEY,
             password TEXT NOT NULL,
             security_question TEXT NOT NULL,
             security_answer TEXT NOT NULL
-        )
-    """)
-    # Images table: stores image path and username of editor
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS images (
+        )""",
+        # Images table: stores image path and username of editor
+        """CREATE TABLE IF NOT EXISTS images (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             image_path TEXT NOT NULL,
             username TEXT NOT NULL,
             FOREIGN KEY (username) REFERENCES users (username)
-        )
-    """)
-    conn.commit()
-    conn.close()
+        )""",
+    ],
+    # 2: telemetry, one row per timed command, undo or redo
+    [
+        """CREATE TABLE IF NOT EXISTS telemetry (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            recorded_at REAL NOT NULL,
+            command TEXT NOT NULL,
+            action TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            gui_seconds REAL NOT NULL,
+            allocated_bytes INTEGER NOT NULL,
+            undo_memory_bytes INTEGER NOT NULL,
+            undo_disk_bytes INTEGER NOT NULL,
+            rss_bytes INTEGER NOT NULL
+        )""",
+    ],
+    # 3: history paging by (username, id), save times and sizes, and full-text path search
+    [
+        "ALTER TABLE images ADD COLUMN created_at REAL",
+        "ALTER TABLE images ADD COLUMN file_size INTEGER",
+        "CREATE INDEX IF NOT EXISTS images_username_id ON images (username, id)",
+        "CREATE VIRTUAL TABLE images_fts USING fts5(image_path, content='images', content_rowid='id')",
+        """CREATE TRIGGER images_fts_insert AFTER INSERT ON images BEGIN
+            INSERT INTO images_fts (rowid, image_path) VALUES (new.id, new.image_path);
+        END""",
+        """CREATE TRIGGER images_fts_delete AFTER DELETE ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, image_path) VALUES ('delete', old.id, old.image_path);
+        END""",
+        """CREATE TRIGGER images_fts_update AFTER UPDATE OF image_path ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, image_path) VALUES ('delete', old.id, old.image_path);
+            INSERT INTO images_fts (rowid, image_path) VALUES (new.id, new.image_path);
+        END""",
+        "INSERT INTO images_fts (images_fts) VALUES ('rebuild')",
+    ],
+]
+
+# Edit history is read this many rows at a time
+HISTORY_PAGE_SIZE = 200
+
+# Statements are kept as constants so every call reuses the connection's prepared statement
+INSERT_USER = "INSERT INTO users (username, password, security_question, security_answer) VALUES (?, ?, ?, ?)"
+SELECT_PASSWORD = "SELECT password FROM users WHERE username = ?"
+SELECT_SECURITY_QUESTION = "SELECT security_question, security_answer FROM users WHERE username = ?"
+SELECT_SECURITY_ANSWER = "SELECT security_answer FROM users WHERE username = ?"
+UPDATE_PASSWORD = "UPDATE users SET password = ? WHERE username = ?"
+INSERT_IMAGE = "INSERT INTO images (image_path, username, created_at, file_size) VALUES (?, ?, ?, ?)"
+SELECT_USER_IMAGES = "SELECT image_path FROM images WHERE username = ? ORDER BY id"
+# Keyset pagination: newest first, each page starting below the last id already read
+SELECT_HISTORY_PAGE = """SELECT id, image_path, created_at, file_size FROM images
+    WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?"""
+SEARCH_HISTORY_PAGE = """SELECT images.id, images.image_path, images.created_at, images.file_size
+    FROM images_fts JOIN images ON images.id = images_fts.rowid
+    WHERE images_fts MATCH ? AND images.username = ? AND images.id < ? ORDER BY images.id DESC LIMIT ?"""
+INSERT_TELEMETRY = (f"INSERT INTO telemetry ({', '.join(TELEMETRY_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(TELEMETRY_COLUMNS))})")
+
+_local = threading.local()
+
+def hash_password(password):
+    """Hash a password using SHA-256."""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def migrate(conn):
+    """Apply the migrations conn's database has not had yet, each in its own transaction."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another connection may have migrated while this one waited for the write lock
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+def get_connection():
+    """Return this thread's long-lived connection to DATABASE_FILE, opening and migrating it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DATABASE_FILE:
+        return conn
+    close_connection()
+    conn = sqlite3.connect(DATABASE_FILE, cached_statements=64)
+    # WAL lets readers and a writer work at once and turns most commits into
+    # appends; with synchronous=NORMAL only checkpoints wait for an fsync
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -8192")  # 8 MB
+    conn.execute("PRAGMA temp_store = MEMORY")
+    migrate(conn)
+    _local.conn = conn
+    _local.path = DATABASE_FILE
+    return conn
+
+def close_connection():
+    """Close this thread's connection, if it has one."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+def init_database():
+    """Initialize the SQLite database, bringing its schema up to date."""
+    get_connection()
 
 def add_user(username, password, security_question, security_answer):
     """Add a new user to the database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
+    conn = get_connection()
     try:
-        c.execute("INSERT INTO users (username, password, security_question, security_answer) VALUES (?, ?, ?, ?)",
-                  (username, hash_password(password), security_question, hash_password(security_answer)))
-        conn.commit()
+        with conn:
+            conn.execute(INSERT_USER, (username, hash_password(password), security_question,
+                                       hash_password(security_answer)))
         return True
     except sqlite3.IntegrityError:
         return False  # Username already exists
-    finally:
-        conn.close()
 
 def verify_user(username, password):
     """Verify user credentials."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT password FROM users WHERE username = ?", (username,))
-    result = c.fetchone()
-    conn.close()
+    result = get_connection().execute(SELECT_PASSWORD, (username,)).fetchone()
     if result and result[0] == hash_password(password):
         return True
     return False
 
 def get_security_question(username):
     """Get the security question and hashed answer for a user."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT security_question, security_answer FROM users WHERE username = ?", (username,))
-    result = c.fetchone()
-    conn.close()
-    return result  # Returns (question, hashed_answer) or None
+    return get_connection().execute(SELECT_SECURITY_QUESTION, (username,)).fetchone()  # Returns (question, hashed_answer) or None
 
 def reset_password(username, new_password, security_answer):
     """Reset a user's password if the security answer matches."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT security_answer FROM users WHERE username = ?", (username,))
-    result = c.fetchone()
-    if result and result[0] == hash_password(security_answer):
-        c.execute("UPDATE users SET password = ? WHERE username = ?",
-                  (hash_password(new_password), username))
-        conn.commit()
-        conn.close()
-        return True
-    conn.close()
+    conn = get_connection()
+    with conn:
+        result = conn.execute(SELECT_SECURITY_ANSWER, (username,)).fetchone()
+        if result and result[0] == hash_password(security_answer):
+            conn.execute(UPDATE_PASSWORD, (hash_password(new_password), username))
+            return True
     return False
 
 def delete_all_users():
     """Delete all users and their image history."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM users")
-    c.execute("DELETE FROM images")
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM users")
+        conn.execute("DELETE FROM images")
+
+def _image_row(image_path, username):
+    try:
+        file_size = os.path.getsize(image_path)
+    except OSError:
+        file_size = None
+    return image_path, username, time.time(), file_size
 
 def add_image_edit(image_path, username):
     """Record an image edit by a user."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("INSERT INTO images (image_path, username) VALUES (?, ?)", (image_path, username))
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        conn.execute(INSERT_IMAGE, _image_row(image_path, username))
+
+def add_image_edits(edits):
+    """Record a batch of (image_path, username) edits in one transaction."""
+    conn = get_connection()
+    with conn:
+        conn.executemany(INSERT_IMAGE, (_image_row(image_path, username) for image_path, username in edits))
 
 def get_user_images(username):
     """Get all images edited by a user."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT image_path FROM images WHERE username = ?", (username,))
-    results = c.fetchall()
-    conn.close()
-    return [row[0] for row in results]
\ No newline at end of file
+    return [row[0] for row in get_connection().execute(SELECT_USER_IMAGES, (username,))]
+
+def _search_query(search):
+    """Turn free text into an FTS5 query matching paths that contain a word starting with every term."""
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in search.split())
+
+def get_user_image_page(username, before_id=None, limit=HISTORY_PAGE_SIZE, search=None):
+    """Get up to limit of a user's edits older than before_id, newest first.
+
+    Rows are (id, image_path, created_at, file_size); created_at and file_size
+    are None for edits recorded before they were tracked. With search, only
+    paths containing words that start with each of its terms are returned.
+    """
+    before_id = before_id if before_id is not None else 2**63 - 1
+    conn = get_connection()
+    if search and search.split():
+        return conn.execute(SEARCH_HISTORY_PAGE, (_search_query(search), username, before_id, limit)).fetchall()
+    return conn.execute(SELECT_HISTORY_PAGE, (username, before_id, limit)).fetchall()
+
+def add_telemetry_events(events):
+    """Record a batch of telemetry events, each a tuple in TELEMETRY_COLUMNS order, in one transaction."""
+    conn = get_connection()
+    with conn:
+        conn.executemany(INSERT_TELEMETRY, events)
@@ -0,0 +1,129 @@
+# src/folder_browser.py
+import os
+from collections import OrderedDict
+from PyQt5.QtWidgets import (QDockWidget, QWidget, QVBoxLayout, QHBoxLayout, QListView,
+                             QPushButton, QLabel, QFileDialog)
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QPixmap, QColor
+from .thumbnails import THUMBNAIL_SIZE, ThumbnailCache, ThumbnailWorker
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+# Thumbnails kept as pixmaps; ones scrolled further away come back from the disk cache
+MEMORY_THUMBNAILS = 1000
+
+class FolderModel(QAbstractListModel):
+    """The images of one folder, with thumbnails loaded by a thread pool as rows are first painted."""
+    def __init__(self, cache, thread_pool, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.thread_pool = thread_pool
+        self.paths = []
+        self.rows = {}
+        self.thumbnails = OrderedDict()
+        self.workers = {}
+        self.generation = 0
+        self.priority = 0
+        self.placeholder = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self.placeholder.fill(QColor(64, 64, 64))
+
+    def setFolder(self, folder):
+        """List the images in folder, dropping the thumbnails still pending for the previous one."""
+        for worker in self.workers.values():
+            worker.cancel()
+        self.beginResetModel()
+        self.generation += 1
+        self.workers = {}
+        self.thumbnails.clear()
+        try:
+            entries = [entry.path for entry in os.scandir(folder)
+                       if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)]
+        except OSError:
+            entries = []
+        self.paths = sorted(entries, key=lambda path: os.path.basename(path).lower())
+        self.rows = {path: row for row, path in enumerate(self.paths)}
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.DisplayRole:
+            return os.path.basename(path)
+        if role in (Qt.ToolTipRole, Qt.UserRole):
+            return path
+        if role == Qt.DecorationRole:
+            return self.thumbnail(path)
+        return None
+
+    def thumbnail(self, path):
+        """The thumbnail of path, or a placeholder while a worker fetches it."""
+        pixmap = self.thumbnails.get(path)
+        if pixmap is not None:
+            self.thumbnails.move_to_end(path)
+            return pixmap
+        if path not in self.workers:
+            worker = ThumbnailWorker(self.cache, path, self.generation)
+            worker.signals.loaded.connect(self.thumbnailLoaded)
+            self.workers[path] = worker
+            # Rows are painted as they scroll into view, so the latest requests go first
+            self.priority += 1
+            self.thread_pool.start(worker, self.priority)
+        return self.placeholder
+
+    def thumbnailLoaded(self, generation, path, image):
+        if generation != self.generation:
+            return
+        self.workers.pop(path, None)
+        self.thumbnails[path] = QPixmap.fromImage(image) if not image.isNull() else self.placeholder
+        while len(self.thumbnails) > MEMORY_THUMBNAILS:
+            self.thumbnails.popitem(last=False)
+        index = self.index(self.rows[path])
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+class FolderBrowser(QDockWidget):
+    """Dock with a filmstrip of the images in a folder; activating one opens it."""
+    imageActivated = pyqtSignal(str)
+
+    def __init__(self, parent=None, cache=None):
+        super().__init__("Folder", parent)
+        self.setAllowedAreas(Qt.LeftDockWidgetArea | Qt.RightDockWidgetArea | Qt.BottomDockWidgetArea)
+        self.thread_pool = QThreadPool(self)
+        self.model = FolderModel(cache if cache is not None else ThumbnailCache(), self.thread_pool, self)
+        self.setupUI()
+
+    def setupUI(self):
+        """Set up the folder button and the thumbnail list."""
+        layout = QVBoxLayout()
+        folder_layout = QHBoxLayout()
+        open_button = QPushButton("Open Folder...")
+        open_button.clicked.connect(self.chooseFolder)
+        folder_layout.addWidget(open_button)
+        self.folder_label = QLabel()
+        folder_layout.addWidget(self.folder_label, 1)
+        layout.addLayout(folder_layout)
+
+        self.list_view = QListView()
+        self.list_view.setModel(self.model)
+        self.list_view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        # Uniform sizes let the view lay out thousands of rows without asking each one
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.activated.connect(lambda index: self.imageActivated.emit(index.data(Qt.UserRole)))
+        layout.addWidget(self.list_view)
+
+        container = QWidget()
+        container.setLayout(layout)
+        self.setWidget(container)
+
+    def chooseFolder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Open Folder")
+        if folder:
+            self.setFolder(folder)
+
+    def setFolder(self, folder):
+        """Show the images in folder."""
+        self.folder_label.setText(os.path.basename(folder) or folder)
+        self.folder_label.setToolTip(folder)
+        self.model.setFolder(folder)
@@ -1,30 +1,54 @@
 # src/gui.py
 import os
+import time
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QLabel, QAction,
                              QSlider, QToolButton, QToolBar, QDockWidget, QMessageBox,
-                             QGridLayout, QScrollArea, QFileDialog, QListWidget)
-from PyQt5.QtCore import Qt, QSize, QRect
+                             QGridLayout, QScrollArea, QFileDialog, QProgressBar,
+                             QProgressDialog, QTableWidget, QTableWidgetItem, QHeaderView)
+from PyQt5.QtCore import Qt, QSize, QRect, QTimer, QThreadPool
 from PyQt5.QtGui import QIcon, QImage, QPalette, QPainter
 from PyQt5.QtPrintSupport import QPrinter, QPrintDialog
 from .image_label import imageLabel
 from .commands import (CropCommand, ResizeCommand, RotateCommand, FlipCommand,
-                      GrayscaleCommand, RGBCommand, SepiaCommand, BrightnessCommand,
-                      ContrastCommand, ZoomCommand, HueCommand)
+                      GrayscaleCommand, RGBCommand, SepiaCommand, ZoomCommand,
+                      HueCommand, ChannelMixerCommand, AdjustmentCommand, ImageCommand,
+                      RecipeCommand)
+from .recipes import recipe_from_commands, save_recipe, load_recipe
+from .workers import CommandWorker, FileRecipeWorker
+from .undo_store import ReplayUndoStore, UndoSnapshot, UndoStore
+from .telemetry import FLUSH_INTERVAL_MS, TelemetryRecorder, current_rss
 from .constants import ICON_PATH
-from .database import add_image_edit, get_user_images
+from .channel_mixer import ChannelMixerDialog
+from .database import add_image_edit
+from .history import EditHistoryDialog
+from .folder_browser import FolderBrowser
+from .image_io import probe_image, is_large
+from .large_image import LargeImageDialog
 from PyQt5.QtWidgets import QPushButton, QDialog, QVBoxLayout
 
 
 
 
 class PhotoEditorGUI(QMainWindow):
-    def __init__(self, username):
+    def __init__(self, username, undo_store=None, telemetry=None):
         super().__init__()
         self.username = username  # Store logged-in username
         self.undo_stack = []
         self.redo_stack = []
+        # UndoStore keeps a delta per command; ReplayUndoStore checkpoints and replays instead
+        self.undo_store = UndoStore() if undo_store is None else undo_store
+        self.telemetry = TelemetryRecorder(username) if telemetry is None else telemetry
         self.zoom_factor = 1
         self.image = QImage()
+        self.pending_adjustment = None
+        self.queued_commands = []  # (command, is_redo) pairs waiting for the worker
+        self.active_worker = None
+        # Not the global pool: Qt splits large image conversions across that one and waits
+        # for them on the GUI thread, which would deadlock behind a worker wanting the GIL
+        self.thread_pool = QThreadPool(self)
+        # Files of a multi-file apply run side by side, apart from the command worker
+        self.file_pool = QThreadPool(self)
+        self.file_workers = []
         self.initializeUI()
 
     def initializeUI(self):
@@ -33,8 +57,11 @@ class PhotoEditorGUI(QMainWindow):
         self.showMaximized()
         self.createMainLabel()
         self.createEditingBar()
+        self.createFolderBrowser()
+        self.createPerformancePanel()
         self.createMenu()
         self.createToolBar()
+        self.createStatusBar()
         self.show()
 
     def createMenu(self):
@@ -49,6 +76,10 @@ class PhotoEditorGUI(QMainWindow):
         self.open_act.setShortcut('Ctrl+O')
         self.open_act.triggered.connect(self.openImage)
 
+        self.apply_to_files_act = QAction("Apply Edits to Files...", self)
+        self.apply_to_files_act.triggered.connect(self.applyEditsToFiles)
+        self.apply_to_files_act.setEnabled(False)
+
         self.print_act = QAction(QIcon(os.path.join(ICON_PATH, "print.png")), "Print...", self)
         self.print_act.setShortcut('Ctrl+P')
         self.print_act.setEnabled(False)
@@ -69,6 +100,12 @@ class PhotoEditorGUI(QMainWindow):
         self.redo_act.triggered.connect(self.redo)
         self.redo_act.setEnabled(False)
 
+        # Off keeps a compressed delta per command; on keeps only occasional checkpoints and replays
+        self.replay_undo_act = QAction("Low-Memory Undo", self)
+        self.replay_undo_act.setCheckable(True)
+        self.replay_undo_act.setChecked(isinstance(self.undo_store, ReplayUndoStore))
+        self.replay_undo_act.toggled.connect(self.setReplayUndo)
+
         self.revert_act = QAction("Revert to Original", self)
         self.revert_act.triggered.connect(self.image_label.revertToOriginal)
         self.revert_act.setEnabled(False)
@@ -108,6 +145,17 @@ class PhotoEditorGUI(QMainWindow):
         self.normal_size_Act.triggered.connect(self.normalSize)
         self.normal_size_Act.setEnabled(False)
 
+        self.channel_mixer_act = QAction("Channel Mixer...", self)
+        self.channel_mixer_act.triggered.connect(self.mixChannels)
+
+        self.save_recipe_act = QAction("Save Edit Recipe...", self)
+        self.save_recipe_act.triggered.connect(self.saveRecipe)
+        self.save_recipe_act.setEnabled(False)
+
+        self.apply_recipe_act = QAction("Apply Edit Recipe...", self)
+        self.apply_recipe_act.triggered.connect(self.applyRecipe)
+        self.apply_recipe_act.setEnabled(False)
+
         self.history_act = QAction('Edit History', self)
         self.history_act.triggered.connect(self.showEditHistory)
 
@@ -122,13 +170,18 @@ class PhotoEditorGUI(QMainWindow):
 
         file_menu = menu_bar.addMenu('File')
         file_menu.addAction(self.open_act)
+        file_menu.addAction(self.apply_to_files_act)
         file_menu.addAction(self.save_act)
         file_menu.addSeparator()
+        file_menu.addAction(self.save_recipe_act)
+        file_menu.addAction(self.apply_recipe_act)
+        file_menu.addSeparator()
         file_menu.addAction(self.print_act)
 
         edit_menu = menu_bar.addMenu('Edit')
         edit_menu.addAction(self.undo_act)
         edit_menu.addAction(self.redo_act)
+        edit_menu.addAction(self.replay_undo_act)
         edit_menu.addSeparator()
         edit_menu.addAction(self.revert_act)
 
@@ -141,12 +194,16 @@ class PhotoEditorGUI(QMainWindow):
         tool_menu.addAction(self.flip_horizontal)
         tool_menu.addAction(self.flip_vertical)
         tool_menu.addSeparator()
+        tool_menu.addAction(self.channel_mixer_act)
+        tool_menu.addSeparator()
         tool_menu.addAction(self.zoom_in_act)
         tool_menu.addAction(self.zoom_out_act)
         tool_menu.addAction(self.normal_size_Act)
 
         views_menu = menu_bar.addMenu('Views')
         views_menu.addAction(self.tools_menu_act)
+        views_menu.addAction(self.folder_browser_act)
+        views_menu.addAction(self.performance_act)
 
     def createToolBar(self):
         tool_bar = QToolBar("Main Toolbar")
@@ -170,6 +227,14 @@ class PhotoEditorGUI(QMainWindow):
         tool_bar.addAction(self.zoom_in_act)
         tool_bar.addAction(self.zoom_out_act)
 
+    def createStatusBar(self):
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.hide()
+        self.undo_memory_label = QLabel()
+        self.statusBar().addPermanentWidget(self.undo_memory_label)
+        self.statusBar().addPermanentWidget(self.progress_bar)
+
     def createEditingBar(self):
         self.editing_bar = QDockWidget("Tools")
         self.editing_bar.setAllowedAreas(Qt.LeftDockWidgetArea | Qt.RightDockWidgetArea)
@@ -196,21 +261,33 @@ class PhotoEditorGUI(QMainWindow):
         self.brightness_slider.setRange(-60,60)
         self.brightness_slider.setTickInterval(35)
         self.brightness_slider.setTickPosition(QSlider.TicksAbove)
-        self.brightness_slider.valueChanged.connect(self.changeBrightness)
+        self.brightness_slider.valueChanged.connect(lambda value: self.adjustImage("brightness", value))
 
         contrast_label = QLabel("Contrast")
         self.contrast_slider = QSlider(Qt.Horizontal)
         self.contrast_slider.setRange(-30, 30)
         self.contrast_slider.setTickInterval(35)
         self.contrast_slider.setTickPosition(QSlider.TicksAbove)
-        self.contrast_slider.valueChanged.connect(self.changeContrast)
+        self.contrast_slider.valueChanged.connect(lambda value: self.adjustImage("contrast", value))
 
         hue_label = QLabel("Hue")
         self.hue_slider = QSlider(Qt.Horizontal)
         self.hue_slider.setRange(-180, 180)
         self.hue_slider.setTickInterval(30)
         self.hue_slider.setTickPosition(QSlider.TicksAbove)
-        self.hue_slider.valueChanged.connect(self.changeHue)
+        self.hue_slider.valueChanged.connect(lambda value: self.adjustImage("hue", value))
+
+        # While a slider is dragged only a proxy is rendered; the full image is
+        # rendered when it is released or has been still for a moment
+        self.adjustment_timer = QTimer(self)
+        self.adjustment_timer.setSingleShot(True)
+        self.adjustment_timer.setInterval(250)
+        self.adjustment_timer.timeout.connect(self.commitAdjustment)
+        self.adjustment_sliders = {"brightness": self.brightness_slider,
+                                   "contrast": self.contrast_slider,
+                                   "hue": self.hue_slider}
+        for slider in self.adjustment_sliders.values():
+            slider.sliderReleased.connect(self.commitAdjustment)
 
         editing_grid = QGridLayout()
         editing_grid.addWidget(convert_to_grayscale, 1, 0)
@@ -231,9 +308,80 @@ class PhotoEditorGUI(QMainWindow):
         self.addDockWidget(Qt.LeftDockWidgetArea, self.editing_bar)
         self.tools_menu_act = self.editing_bar.toggleViewAction()
 
+    def createFolderBrowser(self):
+        self.folder_browser = FolderBrowser(self)
+        self.folder_browser.imageActivated.connect(self.loadImage)
+        self.addDockWidget(Qt.LeftDockWidgetArea, self.folder_browser)
+        self.folder_browser_act = self.folder_browser.toggleViewAction()
+
+    def createPerformancePanel(self):
+        """Dockable panel with the slowest recent operations and the current memory footprint."""
+        self.performance_panel = QDockWidget("Performance")
+        self.performance_panel.setAllowedAreas(Qt.LeftDockWidgetArea | Qt.RightDockWidgetArea)
+
+        self.memory_footprint_label = QLabel()
+        self.slowest_table = QTableWidget(0, 5)
+        self.slowest_table.setHorizontalHeaderLabels(["Operation", "Size", "Time", "GUI Time", "Allocated"])
+        self.slowest_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.slowest_table.verticalHeader().hide()
+        self.slowest_table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.memory_footprint_label)
+        layout.addWidget(QLabel("Slowest recent operations"))
+        layout.addWidget(self.slowest_table)
+        container = QWidget()
+        container.setLayout(layout)
+        self.performance_panel.setWidget(container)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.performance_panel)
+        self.performance_panel.hide()
+        self.performance_act = self.performance_panel.toggleViewAction()
+        self.performance_panel.visibilityChanged.connect(self.updatePerformancePanel)
+
+        # Telemetry is written in batches; the timer also writes out any stragglers
+        self.telemetry_timer = QTimer(self)
+        self.telemetry_timer.setInterval(FLUSH_INTERVAL_MS)
+        self.telemetry_timer.timeout.connect(self.telemetry.flush)
+        self.telemetry_timer.timeout.connect(self.updatePerformancePanel)
+        self.telemetry_timer.start()
+
+    def updatePerformancePanel(self):
+        if not self.performance_panel.isVisible():
+            return
+        memory, disk = self.undo_store.usage(self.undo_stack)
+        self.memory_footprint_label.setText(f"Process: {current_rss() / 2**20:.0f} MB\n"
+                                            f"Undo: {memory / 2**20:.0f} MB in memory, {disk / 2**20:.0f} MB on disk")
+        events = self.telemetry.slowest()
+        self.slowest_table.setRowCount(len(events))
+        for row, event in enumerate(events):
+            cells = [f"{event.command} ({event.action})", f"{event.width}x{event.height}",
+                     f"{event.seconds * 1000:.0f} ms", f"{event.gui_seconds * 1000:.0f} ms",
+                     f"{event.allocated_bytes / 2**20:.1f} MB"]
+            for column, text in enumerate(cells):
+                self.slowest_table.setItem(row, column, QTableWidgetItem(text))
+
+    def telemetryStart(self):
+        """The start time, image and undo memory that recordTelemetry measures a command against."""
+        return time.perf_counter(), self.image_label.image.cacheKey(), self.undo_store.usage(self.undo_stack)[0]
+
+    def recordTelemetry(self, command, action, start, gui_seconds=None):
+        """Record how long command took since start and what it allocated.
+
+        gui_seconds is how much of that blocked the GUI thread, all of it by default.
+        """
+        started, image_key, undo_memory = start
+        seconds = time.perf_counter() - started
+        image = self.image_label.image
+        usage = self.undo_store.usage(self.undo_stack)
+        # A new image buffer, plus whatever undo data the command added
+        allocated = (image.sizeInBytes() if image.cacheKey() != image_key else 0) + max(0, usage[0] - undo_memory)
+        self.telemetry.record(command, action, image, seconds, seconds if gui_seconds is None else gui_seconds,
+                              allocated, usage)
+        self.updatePerformancePanel()
+
     def createMainLabel(self):
         self.image_label = imageLabel(self)
-        self.image_label.resize(self.image_label.pixmap().size())
+        self.image_label.resize(self.image_label.image.size())
         self.scroll_area = QScrollArea()
         self.scroll_area.setBackgroundRole(QPalette.Dark)
         self.scroll_area.setAlignment(Qt.AlignCenter)
@@ -251,7 +399,7 @@ class PhotoEditorGUI(QMainWindow):
     #         self.updateActions()
     def saveOriginalImage(self, file_name):
     # Store the original image for later use (e.g., reset or undo operations)
-        self.original_image = QImage(file_name)  # Load image using QImage for PyQt
+        self.original_image = self.image_label.original_image  # Already decoded by the label
     # Optionally, you could save it to a file or keep it in memory
     # Example: self.original_image.save("original_backup.png") if saving to disk
 
@@ -263,9 +411,26 @@ class PhotoEditorGUI(QMainWindow):
             "Images (*.png *.jpg *.jpeg *.bmp )"
         )
         if file_name:
-            if self.image_label.openImage(file_name):  # Line 249
-                self.setWindowTitle(f"Photo Editor - {self.username} - {file_name}")
-                self.saveOriginalImage(file_name)
+            self.loadImage(file_name)
+
+    def loadImage(self, file_name):
+        """Open file_name in the editor, asking how to open it first if it is very large."""
+        scaled_size, clip_rect = None, None
+        info = probe_image(file_name)
+        if info is not None and is_large(info):
+            dialog = LargeImageDialog(file_name, info, self)
+            if dialog.exec_() != QDialog.Accepted:
+                return
+            scaled_size, clip_rect = dialog.getOptions()
+        if self.image_label.openImage(file_name, scaled_size, clip_rect):
+            title = f"Photo Editor - {self.username} - {file_name}"
+            if scaled_size is not None:
+                title += f" (proxy {scaled_size.width()} x {scaled_size.height()})"
+            elif clip_rect is not None:
+                title += (f" (region {clip_rect.width()} x {clip_rect.height()} "
+                          f"at {clip_rect.x()}, {clip_rect.y()})")
+            self.setWindowTitle(title)
+            self.saveOriginalImage(file_name)
 
 
 
@@ -287,6 +452,88 @@ class PhotoEditorGUI(QMainWindow):
             add_image_edit(file_name, self.username)
             self.updateActions()
 
+    def saveRecipe(self):
+        """Save the edits on the undo stack as a recipe that can be replayed on other images."""
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save Edit Recipe", "", "Edit Recipes (*.json)")
+        if file_name:
+            save_recipe(recipe_from_commands(self.undo_stack), file_name)
+
+    def applyRecipe(self):
+        """Apply a saved edit recipe to the current image as one undoable step."""
+        if not self.image_label.image.isNull():
+            file_name, _ = QFileDialog.getOpenFileName(self, "Apply Edit Recipe", "", "Edit Recipes (*.json)")
+            if file_name:
+                try:
+                    recipe = load_recipe(file_name)
+                except (OSError, ValueError, KeyError) as e:
+                    QMessageBox.warning(self, "Error", f"Unable to read recipe: {e}", QMessageBox.Ok)
+                    return
+                self.executeCommand(RecipeCommand(self.image_label, recipe))
+
+    def applyEditsToFiles(self):
+        """Apply the edits on the undo stack to a selection of files in background workers."""
+        recipe = recipe_from_commands(self.undo_stack)
+        if not recipe["steps"]:
+            return
+        file_names, _ = QFileDialog.getOpenFileNames(self, "Apply Edits to Files", "",
+                                                     "Images (*.png *.jpg *.jpeg *.bmp )")
+        if not file_names:
+            return
+        output_dir = QFileDialog.getExistingDirectory(self, "Save Edited Files To")
+        if not output_dir:
+            return
+
+        self.file_progress = QProgressDialog("Applying edits...", "Cancel", 0, len(file_names), self)
+        self.file_progress.setWindowTitle("Apply Edits to Files")
+        self.file_progress.setMinimumDuration(0)
+        self.file_progress.canceled.connect(self.cancelFileWorkers)
+        self.file_failures = []
+        self.files_done = 0
+        # Paths no worker may write: the originals, then each target as it is handed out
+        taken = {os.path.normcase(os.path.abspath(file_name)) for file_name in file_names}
+        for file_name in file_names:
+            stem, extension = os.path.splitext(os.path.basename(file_name))
+            target = os.path.join(output_dir, stem + extension)
+            if os.path.abspath(target) == os.path.abspath(file_name):
+                stem += "_edited"
+                target = os.path.join(output_dir, stem + extension)
+            # Same-named files from different folders get _2, _3... rather than one overwriting another
+            number = 2
+            while os.path.normcase(os.path.abspath(target)) in taken:
+                target = os.path.join(output_dir, f"{stem}_{number}{extension}")
+                number += 1
+            taken.add(os.path.normcase(os.path.abspath(target)))
+            worker = FileRecipeWorker(file_name, target, recipe)
+            worker.signals.finished.connect(self.fileFinished)
+            self.file_workers.append(worker)
+            self.file_pool.start(worker)
+        self.updateActions()
+
+    def fileFinished(self, source, target, error):
+        """Log one finished file and advance the aggregate progress."""
+        if error:
+            if error != "cancelled":
+                self.file_failures.append(f"{source}: {error}")
+        else:
+            add_image_edit(target, self.username)
+        self.files_done += 1
+        total = len(self.file_workers)
+        self.file_progress.setLabelText(f"Applying edits... {self.files_done} of {total}")
+        self.file_progress.setValue(self.files_done)
+        if self.files_done == total:
+            self.file_workers.clear()
+            self.file_progress.close()
+            self.updateActions()
+            if self.file_failures:
+                QMessageBox.warning(self, "Apply Edits to Files",
+                                    "Some files could not be edited:\n" + "\n".join(self.file_failures),
+                                    QMessageBox.Ok)
+
+    def cancelFileWorkers(self):
+        """Skip every file that has not been started yet."""
+        for worker in self.file_workers:
+            worker.cancel()
+
     def printImage(self):
         """Handle printing of the current image."""
         if not self.image_label.image.isNull():
@@ -306,43 +553,157 @@ class PhotoEditorGUI(QMainWindow):
 
     def showEditHistory(self):
         """Show the user's edit history."""
-        images = get_user_images(self.username)
-        history_dialog = QDialog(self)
-        history_dialog.setWindowTitle(f"Edit History for {self.username}")
-        history_dialog.setFixedSize(400, 300)
-        layout = QVBoxLayout()
-
-        list_widget = QListWidget()
-        list_widget.addItems(images if images else ["No images edited yet."])
-        layout.addWidget(list_widget)
-
-        close_button = QPushButton("Close")
-        close_button.clicked.connect(history_dialog.accept)
-        layout.addWidget(close_button)
-
-        history_dialog.setLayout(layout)
-        history_dialog.exec_()
+        EditHistoryDialog(self.username, self).exec_()
 
     def executeCommand(self, command):
+        if isinstance(command, ImageCommand):
+            self.queueCommand(command)
+            return
+        start = self.telemetryStart()
         command.execute()
         self.undo_stack.append(command)
         self.redo_stack.clear()
+        self.undo_store.enforce(self.undo_stack)
+        self.recordTelemetry(command, "execute", start)
         self.updateActions()
 
+    def queueCommand(self, command, is_redo=False):
+        """Run an image command on a worker thread once the commands before it are done."""
+        # A redo is a step of the history, so only fresh edits are dropped for a newer one
+        self.queued_commands = [(queued, redo) for queued, redo in self.queued_commands
+                                if redo or not command.supersedes(queued)]
+        if (self.active_worker is not None and not self.active_worker.shown and not self.active_worker.is_redo
+                and command.supersedes(self.active_worker.command)):
+            # The running result would be replaced straight away, so drop it
+            self.active_worker.cancel()
+            self.active_worker = None
+        self.queued_commands.append((command, is_redo))
+        self.startNextCommand()
+
+    def startNextCommand(self):
+        if self.active_worker is None and self.queued_commands:
+            command, is_redo = self.queued_commands.pop(0)
+            start = self.telemetryStart()
+            self.flattenBeforeCommand(command)
+            worker = CommandWorker(command, command.begin(), self.undo_store.pack)
+            worker.is_redo = is_redo
+            worker.shown = False
+            worker.telemetry_start = start
+            worker.gui_seconds = time.perf_counter() - start[0]
+            worker.signals.progress.connect(lambda value: self.commandProgress(worker, value))
+            worker.signals.finished.connect(lambda image: self.commandFinished(worker, image))
+            worker.signals.packed.connect(lambda: self.commandPacked(worker))
+            worker.signals.failed.connect(lambda message: self.commandFailed(worker, message))
+            self.active_worker = worker
+            self.progress_bar.setValue(0)
+            self.progress_bar.show()
+            self.thread_pool.start(worker)
+        elif self.active_worker is None:
+            self.progress_bar.hide()
+        self.updateActions()
+
+    def commandProgress(self, worker, value):
+        if worker is self.active_worker:
+            self.progress_bar.setValue(value)
+
+    def commandFinished(self, worker, image):
+        """Swap a worker's result into the label while the worker packs its undo data."""
+        if worker is not self.active_worker:
+            return
+        finishing = time.perf_counter()
+        worker.command.finish(image)
+        # Too late to cancel for a newer slider value: the result is on screen
+        worker.shown = True
+        worker.gui_seconds += time.perf_counter() - finishing
+
+    def commandPacked(self, worker):
+        """Record a worker's command once its undo data is packed, and start the next one."""
+        if worker is not self.active_worker:
+            return
+        self.active_worker = None
+        finishing = time.perf_counter()
+        command = worker.command
+        if worker.is_redo:
+            self.undo_stack.append(command)
+        else:
+            if self.undo_stack and command.mergeWith(self.undo_stack[-1]):
+                self.undo_stack.pop()
+            self.undo_stack.append(command)
+            self.redo_stack.clear()
+        self.undo_store.enforce(self.undo_stack)
+        worker.gui_seconds += time.perf_counter() - finishing
+        self.recordTelemetry(command, "redo" if worker.is_redo else "execute",
+                             worker.telemetry_start, worker.gui_seconds)
+        self.startNextCommand()
+
+    def commandFailed(self, worker, message):
+        if worker is not self.active_worker:
+            return
+        self.active_worker = None
+        if worker.shown and worker.command.previous_image is not None:
+            # Packing failed after the result was shown; without undo data the edit is taken back
+            self.image_label.showImage(worker.command.previous_image)
+        if worker.is_redo:
+            # redo() already took it off the redo stack; put it back so it can be tried again
+            self.redo_stack.append(worker.command)
+        QMessageBox.warning(self, "Error", f"Unable to apply edit: {message}", QMessageBox.Ok)
+        self.startNextCommand()
+
+    def cancelCommands(self):
+        """Drop queued commands and abandon the running one."""
+        self.queued_commands.clear()
+        if self.active_worker is not None:
+            self.active_worker.cancel()
+            self.active_worker = None
+        self.progress_bar.hide()
+
+    def isBusy(self):
+        return self.active_worker is not None or bool(self.queued_commands)
+
     def undo(self):
-        if self.undo_stack:
+        if self.undo_stack and not self.isBusy():
+            start = self.telemetryStart()
             command = self.undo_stack.pop()
-            command.undo()
+            self.undo_store.undo(command, self.undo_stack, self.image_label)
             self.redo_stack.append(command)
+            self.recordTelemetry(command, "undo", start)
             self.updateActions()
 
     def redo(self):
-        if self.redo_stack:
+        if self.redo_stack and not self.isBusy():
             command = self.redo_stack.pop()
+            if isinstance(command, ImageCommand):
+                self.queueCommand(command, is_redo=True)
+                return
+            start = self.telemetryStart()
             command.execute()
             self.undo_stack.append(command)
+            self.recordTelemetry(command, "redo", start)
             self.updateActions()
 
+    def setReplayUndo(self, replay):
+        """Switch between undo by stored deltas and undo by replay, which is only allowed with no undo history."""
+        if replay == isinstance(self.undo_store, ReplayUndoStore):
+            return
+        self.undo_store = ReplayUndoStore() if replay else UndoStore()
+        if replay and not self.image_label.image.isNull():
+            # Replays start here rather than from the original, which older dropped steps may separate it from
+            self.undo_store.base = UndoSnapshot(self.image_label.image, QImage())
+        self.updateActions()
+
+    def flattenBeforeCommand(self, command):
+        """Bake the slider adjustments into the image before any other pixel command runs."""
+        if not isinstance(command, (AdjustmentCommand, ZoomCommand)):
+            self.image_label.flattenAdjustments()
+
+    def updateSliders(self):
+        """Move the sliders to the adjustment layer's values without triggering new commands."""
+        values = self.image_label.adjustments.values
+        for name, slider in self.adjustment_sliders.items():
+            slider.blockSignals(True)
+            slider.setValue(values[name])
+            slider.blockSignals(False)
+
     def updateActions(self):
         has_image = not self.image_label.image.isNull()
         self.save_act.setEnabled(has_image)
@@ -350,18 +711,23 @@ class PhotoEditorGUI(QMainWindow):
         self.zoom_in_act.setEnabled(has_image and self.zoom_factor < 4.0)
         self.zoom_out_act.setEnabled(has_image and self.zoom_factor > 0.333)
         self.normal_size_Act.setEnabled(has_image)
-        self.undo_act.setEnabled(bool(self.undo_stack))
-        self.redo_act.setEnabled(bool(self.redo_stack))
+        self.undo_act.setEnabled(bool(self.undo_stack) and not self.isBusy())
+        self.redo_act.setEnabled(bool(self.redo_stack) and not self.isBusy())
+        self.replay_undo_act.setEnabled(not self.undo_stack and not self.isBusy())
+        memory, disk = self.undo_store.usage(self.undo_stack)
+        self.undo_memory_label.setText(f"Undo: {memory / 2**20:.0f} MB" +
+                                       (f" + {disk / 2**20:.0f} MB on disk" if disk else ""))
         self.print_act.setEnabled(has_image)
+        self.save_recipe_act.setEnabled(bool(self.undo_stack))
+        self.apply_to_files_act.setEnabled(bool(self.undo_stack) and not self.file_workers)
+        self.apply_recipe_act.setEnabled(has_image)
 
     def cropImage(self):
         if not self.image_label.image.isNull():
             if self.image_label.crop_rect.isValid():
                 command = CropCommand(self.image_label, self.image_label.crop_rect)
                 self.executeCommand(command)
-                self.image_label.crop_rect = QRect()
-                if self.image_label.rubber_band:
-                    self.image_label.rubber_band.hide()
+                self.image_label.clearSelection()
             else:
                 QMessageBox.warning(self, "No Selection",
                                     "Please drag a rectangle over the image to crop.", QMessageBox.Ok)
@@ -396,15 +762,38 @@ class PhotoEditorGUI(QMainWindow):
             command = SepiaCommand(self.image_label)
             self.executeCommand(command)
 
-    def changeBrightness(self, value):
+    def mixChannels(self):
         if not self.image_label.image.isNull():
-            command = BrightnessCommand(self.image_label, value)
-            self.executeCommand(command)
+            mixer_dialog = ChannelMixerDialog(self)
+            if mixer_dialog.exec_() == QDialog.Accepted:
+                command = ChannelMixerCommand(self.image_label, mixer_dialog.getMatrix())
+                self.executeCommand(command)
+
+    def previewSize(self):
+        """Size of the image as shown on screen, clipped to the scroll area's viewport."""
+        size = self.image_label.image.size() * min(self.zoom_factor, 1)
+        viewport = self.scroll_area.viewport().size()
+        if size.width() > viewport.width() or size.height() > viewport.height():
+            size.scale(viewport, Qt.KeepAspectRatio)
+        return size
 
-    def changeContrast(self, value):
+    def adjustImage(self, name, value):
+        """Preview a slider value while it is dragged, otherwise apply it straight away."""
         if not self.image_label.image.isNull():
-            command = ContrastCommand(self.image_label, value)
-            self.executeCommand(command)
+            self.pending_adjustment = (name, value)
+            if self.adjustment_sliders[name].isSliderDown():
+                self.image_label.previewAdjustments(name, value, self.previewSize())
+                self.adjustment_timer.start()
+            else:
+                self.commitAdjustment()
+
+    def commitAdjustment(self):
+        """Render the pending slider value at full resolution as one undo step."""
+        self.adjustment_timer.stop()
+        if self.pending_adjustment is not None:
+            name, value = self.pending_adjustment
+            self.pending_adjustment = None
+            self.executeCommand(AdjustmentCommand(self.image_label, name, value))
 
     def changeHue(self, value=None):
         if not self.image_label.image.isNull():
@@ -439,4 +828,9 @@ class PhotoEditorGUI(QMainWindow):
                 self.showMaximized()
 
     def closeEvent(self, event):
-        pass
\ No newline at end of file
+        # Workers must not emit into the window once it is gone
+        self.cancelCommands()
+        self.cancelFileWorkers()
+        self.thread_pool.waitForDone()
+        self.file_pool.waitForDone()
+        self.telemetry.flush()
\ No newline at end of file
@@ -0,0 +1,126 @@
+# src/history.py
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QLineEdit, QTableView, QHeaderView,
+                             QLabel, QPushButton, QAbstractItemView)
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QDateTime, QTimer
+from .database import HISTORY_PAGE_SIZE, get_user_image_page
+
+class EditHistoryModel(QAbstractTableModel):
+    """A user's edit history, newest first, read from the database one page at a time as it is scrolled."""
+    HEADERS = ("Image", "Saved", "Size")
+
+    def __init__(self, username, parent=None):
+        super().__init__(parent)
+        self.username = username
+        self.search = ""
+        self.rows = []
+        self.exhausted = False
+
+    def setSearch(self, search):
+        """Show only edits whose path matches search, starting again from the newest."""
+        self.beginResetModel()
+        self.search = search
+        self.rows = []
+        self.exhausted = False
+        self.endResetModel()
+        # Fetch the first page straight away so an empty result can be told apart
+        self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        before_id = self.rows[-1][0] if self.rows else None
+        page = get_user_image_page(self.username, before_id, HISTORY_PAGE_SIZE, self.search)
+        self.exhausted = len(page) < HISTORY_PAGE_SIZE
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        _, image_path, created_at, file_size = self.rows[index.row()]
+        if role == Qt.ToolTipRole:
+            return image_path
+        if role != Qt.DisplayRole:
+            return None
+        if index.column() == 0:
+            return image_path
+        if index.column() == 1:
+            # Edits recorded before save times were tracked have none
+            if created_at is None:
+                return ""
+            return QDateTime.fromMSecsSinceEpoch(int(created_at * 1000)).toString("yyyy-MM-dd hh:mm")
+        if file_size is None:
+            return ""
+        return f"{file_size / 2**20:.1f} MB" if file_size >= 2**20 else f"{file_size / 2**10:.0f} KB"
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+class EditHistoryDialog(QDialog):
+    """Searchable list of the images a user has edited."""
+    def __init__(self, username, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Edit History for {username}")
+        self.resize(600, 400)
+        self.model = EditHistoryModel(username, self)
+        self.setupUI()
+        self.model.setSearch("")
+        self.updatePlaceholder()
+
+    def setupUI(self):
+        """Set up the search box and the history table."""
+        layout = QVBoxLayout()
+
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("Search by file name or folder")
+        self.search_box.setClearButtonEnabled(True)
+        # Search once typing pauses rather than on every key
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.search)
+        self.search_box.textChanged.connect(self.search_timer.start)
+        layout.addWidget(self.search_box)
+
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeToContents)
+        layout.addWidget(self.table)
+
+        self.placeholder = QLabel()
+        self.placeholder.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.placeholder)
+
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(self.accept)
+        layout.addWidget(close_button)
+        self.setLayout(layout)
+
+    def search(self):
+        self.model.setSearch(self.search_box.text())
+        self.updatePlaceholder()
+
+    def updatePlaceholder(self):
+        """Explain an empty table."""
+        empty = self.model.rowCount() == 0
+        self.placeholder.setText("No matching images." if self.model.search.strip() else "No images edited yet.")
+        self.placeholder.setVisible(empty)
+        self.table.setVisible(not empty)
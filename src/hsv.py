@@ -0,0 +1,74 @@
+# src/hsv.py
+import numpy as np
+from .pixels import BLUE, GREEN, RED, image_array, row_chunks
+
+def _to_hsv(red, green, blue):
+    """Convert float channel arrays to QColor-style integer hue (-1 for gray), saturation and value."""
+    value = np.maximum(np.maximum(red, green), blue)
+    delta = value - np.minimum(np.minimum(red, green), blue)
+    chromatic = delta > 0
+    safe_delta = np.where(chromatic, delta, 1)
+    hue = np.where(red == value, (green - blue) / safe_delta,
+                   np.where(green == value, 2 + (blue - red) / safe_delta, 4 + (red - green) / safe_delta))
+    hue *= 60
+    np.add(hue, 360, out=hue, where=hue < 0)
+    # QColor keeps hue in hundredths of a degree and hue() truncates to whole degrees
+    hue *= 100
+    np.rint(hue, out=hue)
+    hue /= 100
+    np.floor(hue, out=hue)
+    hue[~chromatic] = -1
+    saturation = np.rint(delta / np.where(chromatic, value, 1) * 255)
+    return hue, saturation, value
+
+def _wrap(angles, period):
+    """Bring values in [0, 2 * period) back into [0, period) in place, cheaper than float modulo."""
+    np.subtract(angles, period, out=angles, where=angles >= period)
+    return angles
+
+def _to_rgb(hue, saturation, value):
+    """Convert integer hue (0-359), saturation and value arrays back to 0-255 float channels."""
+    sector = hue / np.float32(60)
+    chroma = value * saturation
+    chroma /= 255
+    channels = []
+    # Branch-free form of the per-sextant p/q/t selection QColor.toRgb() does
+    for offset in (5, 3, 1):
+        k = _wrap(sector + offset, 6)
+        ramp = np.minimum(k, 4 - k)
+        np.clip(ramp, 0, 1, out=ramp)
+        ramp *= chroma
+        channel = value - ramp
+        channels.append(np.rint(channel, out=channel))
+    return channels
+
+def shift_hsv_array(pixels, hue_shift=0, saturation_shift=0, value_shift=0, lut=None):
+    """Shift hue (degrees), saturation and value (0-255 steps) in place on a (height, width, 4) pixel array.
+
+    Matches shifting each pixel through QColor.setHsv() to within rounding.
+    Gray pixels have no hue, so only their value changes. lut, a (3, 256)
+    red, green, blue table, is applied to each band first so tone and hue
+    changes share one pass over the buffer.
+    """
+    height, width = pixels.shape[:2]
+    for start, stop in row_chunks(height, width):
+        block = pixels[start:stop]
+        if lut is None:
+            red, green, blue = (block[..., channel].astype(np.float32) for channel in (RED, GREEN, BLUE))
+        else:
+            red, green, blue = (table[block[..., channel]].astype(np.float32)
+                                for table, channel in zip(lut, (RED, GREEN, BLUE)))
+        hue, saturation, value = _to_hsv(red, green, blue)
+        gray = hue < 0
+        hue = _wrap(hue + hue_shift % 360, 360)
+        saturation = np.clip(saturation + saturation_shift, 0, 255)
+        saturation[gray] = 0
+        value = np.clip(value + value_shift, 0, 255)
+        for channel, result in zip((RED, GREEN, BLUE), _to_rgb(hue, saturation, value)):
+            block[..., channel] = result
+    return pixels
+
+def shift_hsv(image, hue_shift=0, saturation_shift=0, value_shift=0, lut=None):
+    """Shift hue, saturation and value in place on a 32-bit QImage and return it."""
+    shift_hsv_array(image_array(image), hue_shift, saturation_shift, value_shift, lut)
+    return image
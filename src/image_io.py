@@ -0,0 +1,39 @@
+# src/image_io.py
+from collections import namedtuple
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImageReader
+
+# Images with more pixels than this are offered as a proxy or a region instead of only full size
+LARGE_IMAGE_PIXELS = 50 * 1000 * 1000
+
+ImageInfo = namedtuple("ImageInfo", ("size", "format"))
+
+def probe_image(file_name):
+    """Read the size and format of file_name from its header without decoding it, or return None."""
+    reader = QImageReader(file_name)
+    size = reader.size()
+    if not reader.canRead() or not size.isValid():
+        return None
+    return ImageInfo(size, bytes(reader.format()).decode())
+
+def is_large(info):
+    return info.size.width() * info.size.height() > LARGE_IMAGE_PIXELS
+
+def proxy_size(size, scale):
+    """size reduced by scale, e.g. 4 for a quarter of the width and height."""
+    return QSize(max(1, size.width() // scale), max(1, size.height() // scale))
+
+def read_image(file_name, scaled_size=None, clip_rect=None):
+    """Decode file_name, optionally only clip_rect of it and scaled to scaled_size while decoding.
+
+    clip_rect is in the file's pixel coordinates. JPEGs are scaled in the DCT,
+    so a proxy costs a fraction of a full decode and a full-size buffer is
+    never allocated. Returns (image, error message); the image is null on error.
+    """
+    reader = QImageReader(file_name)
+    if clip_rect is not None:
+        reader.setClipRect(clip_rect)
+    if scaled_size is not None:
+        reader.setScaledSize(scaled_size)
+    image = reader.read()
+    return image, reader.errorString() if image.isNull() else ""
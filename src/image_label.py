@@ -1,40 +1,72 @@
 # src/image_label.py
 from PyQt5.QtWidgets import QLabel, QMessageBox, QSizePolicy, QRubberBand
-from PyQt5.QtCore import Qt, QRect, QSize
-from PyQt5.QtGui import QImage, QPixmap, QTransform, QPalette, qRgb, QColor 
+from PyQt5.QtCore import Qt, QRect, QRectF, QSize, QTimer, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap, QTransform, QPalette, qRgb, QColor, QPainter, QRegion
 from PyQt5.QtWidgets import QFileDialog
+from . import operations
+from .adjustments import AdjustmentLayer
+from .image_io import read_image
+from .pixels import to_working_format
+from .pyramid import ImagePyramid
+from .tiles import TileCache
 
+# Display updates are collected and rendered at most once per frame of this many milliseconds
+FRAME_MS = 16
 
 
 class imageLabel(QLabel):
     """Subclass of QLabel for displaying image."""
+    levelBuilt = pyqtSignal()  # a pyramid level finished building on the pyramid thread
+
     def __init__(self, parent, image=None):
         super().__init__(parent)
         self.parent = parent
         self.image = QImage() if image is None else image
-        self.original_image = self.image
+        self.original_image = QImage(self.image)
+        self.adjustments = AdjustmentLayer()
         self.rubber_band = None
         self.crop_rect = QRect()
         self.origin = None
         self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
-        self.setScaledContents(True)
-        self.setPixmap(QPixmap().fromImage(self.image))
-        self.setAlignment(Qt.AlignCenter)
-
-    def openImage(self, file_name):
-        """Load a new image from file_name into the label."""
+        # The label paints itself, stretching the displayed image over its whole area.
+        # The pyramid holds that image and reduced copies drawn instead of it when
+        # zoomed out; only the tiles of them that reach the screen become pixmaps.
+        # Levels are built in the background; the label repaints once one is ready.
+        self.pyramid = ImagePyramid(self.image, self.levelBuilt.emit)
+        self.levelBuilt.connect(self.update)
+        self.tiles = TileCache()
+        self.pending_image = None
+        self.dirty = QRegion()
+        self.render_all = False
+        self.showing_preview = False
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setTimerType(Qt.PreciseTimer)
+        self.render_timer.setInterval(FRAME_MS)
+        self.render_timer.timeout.connect(self.render)
+
+    def openImage(self, file_name, scaled_size=None, clip_rect=None):
+        """Load a new image from file_name into the label, optionally a region of it or scaled while decoding."""
         if file_name:
-            self.image = QImage(file_name)
-            if self.image.isNull():
-                QMessageBox.information(self, "Error", f"Unable to open image: {file_name}", QMessageBox.Ok)
+            image, error = read_image(file_name, scaled_size, clip_rect)
+            if image.isNull():
+                QMessageBox.information(self, "Error", f"Unable to open image: {file_name}\n{error}", QMessageBox.Ok)
                 return False
-            self.original_image = self.image.copy()
-            self.setPixmap(QPixmap().fromImage(self.image))
-            self.resize(self.pixmap().size())
+            # Converted once here, so no later edit or paint has to
+            self.image = to_working_format(image)
+            # QImage copies share pixels until written to; as a share of its own, the
+            # original also keeps selection edits from patching these pixels in place
+            self.original_image = QImage(self.image)
+            self.clearSelection()
+            self.scheduleRender(self.image)
+            self.resize(self.image.size())
+            self.parent.cancelCommands()
             self.parent.zoom_factor = 1
-            self.parent.brightness_slider.setValue(0)
+            self.adjustments.reset()
+            self.parent.updateSliders()
             self.parent.undo_stack.clear()
             self.parent.redo_stack.clear()
+            self.parent.undo_store.reset()
             self.parent.print_act.setEnabled(True)
             self.parent.updateActions()
             return True
@@ -140,68 +172,118 @@ class imageLabel(QLabel):
                 QMessageBox.Yes | QMessageBox.No, QMessageBox.No
             )
             if reply == QMessageBox.Yes:
-                self.image = self.original_image.copy()
-                self.setPixmap(QPixmap().fromImage(self.image))
-                self.repaint()
+                self.parent.cancelCommands()
+                # showImage() takes a share of its own, so the original is never patched in place
+                self.showImage(self.original_image)
+                self.adjustments.reset()
+                self.parent.updateSliders()
                 self.parent.undo_stack.clear()
                 self.parent.redo_stack.clear()
+                self.parent.undo_store.reset()
                 self.parent.updateActions()
 
+    def showImage(self, image, changed=None):
+        """Make image the current image and display it, resizing the label if its size changed.
+
+        changed is the part of image that differs from the current image, or
+        None if all of it may. Unless image is the current image, patched in
+        place, the label keeps a QImage of its own sharing its pixels, so
+        self.image.isDetached() is true only while nothing else holds them.
+        """
+        resized = image.size() != self.image.size()
+        if image is not self.image:
+            image = QImage(image)
+        self.image = image
+        if resized:
+            self.clearSelection()
+            self.resize(self.parent.zoom_factor * image.size())
+        if self.showing_preview:
+            # A preview is on screen, which differs from image everywhere
+            self.showing_preview = False
+            changed = None
+        self.scheduleRender(image, changed)
+
+    def scheduleRender(self, image, changed=None):
+        """Display image at the next frame, redrawing only changed, in image pixels, if it is given.
+
+        Calls within one frame collapse into a single render of the last image,
+        covering everything any of them changed.
+        """
+        if changed is None:
+            self.render_all = True
+        else:
+            self.dirty += changed
+        self.pending_image = image
+        if not self.render_timer.isActive():
+            self.render_timer.start()
+
+    def render(self):
+        """Make the pending image the displayed one and schedule a paint of what changed."""
+        image, dirty, render_all = self.pending_image, self.dirty, self.render_all
+        self.pending_image, self.dirty, self.render_all = None, QRegion(), False
+        if image is None:
+            return
+        if render_all or image.size() != self.pyramid.image.size():
+            self.pyramid.reset(image)
+            self.tiles.clear()
+            self.update()
+            return
+        self.pyramid.update(image, dirty.boundingRect())
+        self.tiles.invalidate(dirty.boundingRect())
+        for rect in dirty.rects():
+            self.update(self.widgetRect(rect))
+
+    def widgetRect(self, rect):
+        """rect of the displayed image mapped onto the label, grown by a pixel for the smoothing at its edges."""
+        image = self.pyramid.image
+        scale_x = self.width() / max(1, image.width())
+        scale_y = self.height() / max(1, image.height())
+        rect = QRectF(rect.adjusted(-1, -1, 1, 1))
+        return QRectF(rect.x() * scale_x, rect.y() * scale_y,
+                      rect.width() * scale_x, rect.height() * scale_y).toAlignedRect()
+
+    def paintEvent(self, event):
+        """Draw the tiles under the exposed rectangle, from the pyramid level nearest the zoom."""
+        image = self.pyramid.image
+        if image.isNull() or self.width() == 0 or self.height() == 0:
+            return
+        level, divisor = self.pyramid.level(self.width() / image.width())
+        scale_x = level.width() / self.width()
+        scale_y = level.height() / self.height()
+        exposed = QRectF(event.rect())
+        source = QRectF(exposed.x() * scale_x, exposed.y() * scale_y,
+                        exposed.width() * scale_x, exposed.height() * scale_y).toAlignedRect()
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        for tile_rect, pixmap, pixmap_rect in self.tiles.visible(level, divisor, source):
+            target = QRectF(tile_rect.x() / scale_x, tile_rect.y() / scale_y,
+                            tile_rect.width() / scale_x, tile_rect.height() / scale_y)
+            painter.drawPixmap(target, pixmap, QRectF(pixmap_rect))
+
     def resizeImage(self):
         """Resize image."""
         if not self.image.isNull():
-            resize = QTransform().scale(0.5, 0.5)
-            pixmap = QPixmap(self.image)
-            resized_image = pixmap.transformed(resize, mode=Qt.SmoothTransformation)
-            self.image = QImage(resized_image)
-            self.setPixmap(resized_image)
-            self.setScaledContents(True)
-            self.repaint()
+            self.showImage(operations.resize_half(self.image))
 
     def rotateImage90(self, direction):
         """Rotate image 90º clockwise or counterclockwise."""
         if not self.image.isNull():
-            if direction == "cw":
-                transform90 = QTransform().rotate(90)
-            elif direction == "ccw":
-                transform90 = QTransform().rotate(-90)
-            pixmap = QPixmap(self.image)
-            rotated = pixmap.transformed(transform90, mode=Qt.SmoothTransformation)
-            self.resize(self.image.height(), self.image.width())
-            self.image = QImage(rotated)
-            self.setPixmap(rotated.scaled(self.size(), Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation))
-            self.repaint()
+            self.showImage(operations.rotate90(self.image, direction))
 
     def flipImage(self, axis):
         """Mirror the image across the horizontal or vertical axis."""
         if not self.image.isNull():
-            if axis == "horizontal":
-                flip_h = QTransform().scale(-1, 1)
-                pixmap = QPixmap(self.image)
-                flipped = pixmap.transformed(flip_h)
-            elif axis == "vertical":
-                flip_v = QTransform().scale(1, -1)
-                pixmap = QPixmap(self.image)
-                flipped = pixmap.transformed(flip_v)
-            self.image = QImage(flipped)
-            self.setPixmap(flipped)
-            self.repaint()
+            self.showImage(operations.flip(self.image, axis))
 
     def convertToGray(self):
-        """Convert image to grayscale."""
+        """Convert image to grayscale, keeping its working format."""
         if not self.image.isNull():
-            converted_img = self.image.convertToFormat(QImage.Format_Grayscale16)
-            self.image = QImage(converted_img)
-            self.setPixmap(QPixmap().fromImage(converted_img))
-            self.repaint()
+            self.showImage(operations.grayscale(self.image))
 
     def convertToRGB(self):
         """Convert image to RGB format."""
         if not self.image.isNull():
-            converted_img = self.image.convertToFormat(QImage.Format_RGB32)
-            self.image = QImage(converted_img)
-            self.setPixmap(QPixmap().fromImage(converted_img))
-            self.repaint()
+            self.showImage(operations.to_rgb(self.image))
 
     # def convertToSepia(self):
     #     """Convert image to sepia filter."""
@@ -226,28 +308,12 @@ class imageLabel(QLabel):
     def convertToSepia(self):
         """Convert image to sepia filter."""
         if not self.image.isNull():
-            # Convert image to RGB32 format for consistent pixel manipulation
-            sepia_image = self.image.convertToFormat(QImage.Format_RGB32)
-            
-            for row_pixel in range(sepia_image.width()):
-                for col_pixel in range(sepia_image.height()):
-                    current_val = QColor(sepia_image.pixel(row_pixel, col_pixel))
-                    red = current_val.red()
-                    green = current_val.green()
-                    blue = current_val.blue()
-                    
-                    # Apply sepia transformation
-                    new_red = min(int(0.393 * red + 0.769 * green + 0.189 * blue), 255)
-                    new_green = min(int(0.349 * red + 0.686 * green + 0.168 * blue), 255)
-                    new_blue = min(int(0.272 * red + 0.534 * green + 0.131 * blue), 255)
-                    
-                    # Set pixel with valid QRgb value
-                    sepia_image.setPixel(row_pixel, col_pixel, qRgb(new_red, new_green, new_blue))
-            
-            # Update the image and pixmap
-            self.image = sepia_image
-            self.setPixmap(QPixmap.fromImage(self.image))
-            self.repaint()
+            self.showImage(operations.sepia(self.image))
+
+    def mixChannels(self, matrix):
+        """Recombine the red, green and blue channels with a 3x4 color matrix."""
+        if not self.image.isNull():
+            self.showImage(operations.mix_channels(self.image, matrix))
 
     # def changeBrightness(self, value):
     #     """Change brightness of the image."""
@@ -271,28 +337,7 @@ class imageLabel(QLabel):
     def changeBrightness(self, value):
         """Change brightness of the image."""
         if not self.image.isNull():
-            # Convert image to RGB32 format for consistent pixel manipulation
-            bright_image = self.image.convertToFormat(QImage.Format_RGB32)
-            
-            for row_pixel in range(bright_image.width()):
-                for col_pixel in range(bright_image.height()):
-                    current_val = QColor(bright_image.pixel(row_pixel, col_pixel))
-                    red = current_val.red()
-                    green = current_val.green()
-                    blue = current_val.blue()
-                    
-                    # Apply brightness adjustment
-                    new_red = max(0, min(255, red + value))
-                    new_green = max(0, min(255, green + value))
-                    new_blue = max(0, min(255, blue + value))
-                    
-                    # Set pixel with valid QRgb value
-                    bright_image.setPixel(row_pixel, col_pixel, qRgb(new_red, new_green, new_blue))
-            
-            # Update the image and pixmap
-            self.image = bright_image
-            self.setPixmap(QPixmap.fromImage(self.image))
-            self.repaint()
+            self.showImage(operations.brightness(self.image, value))
 
     # def changeContrast(self, contrast):
     #     """Change the contrast of the pixels in the image."""
@@ -315,31 +360,7 @@ class imageLabel(QLabel):
     def changeContrast(self, contrast):
         """Change the contrast of the pixels in the image."""
         if not self.image.isNull():
-            # Convert image to RGB32 format for consistent pixel manipulation
-            contrast_image = self.image.convertToFormat(QImage.Format_RGB32)
-            
-            # Calculate contrast factor
-            factor = float(259 * (contrast + 255) / (255 * (259 - contrast)))
-            
-            for row_pixel in range(contrast_image.width()):
-                for col_pixel in range(contrast_image.height()):
-                    current_val = QColor(contrast_image.pixel(row_pixel, col_pixel))
-                    red = current_val.red()
-                    green = current_val.green()
-                    blue = current_val.blue()
-                    
-                    # Apply contrast adjustment
-                    new_red = max(0, min(255, int(factor * (red - 128) + 128)))
-                    new_green = max(0, min(255, int(factor * (green - 128) + 128)))
-                    new_blue = max(0, min(255, int(factor * (blue - 128) + 128)))
-                    
-                    # Set pixel with valid QRgb value
-                    contrast_image.setPixel(row_pixel, col_pixel, qRgb(new_red, new_green, new_blue))
-            
-            # Update the image and pixmap
-            self.image = contrast_image
-            self.setPixmap(QPixmap.fromImage(self.image))
-            self.repaint()
+            self.showImage(operations.contrast(self.image, contrast))
 
     # def changeHue(self, hue_shift):
     #     """Shift the hue of the image by hue_shift degrees (0-360)."""
@@ -356,21 +377,29 @@ class imageLabel(QLabel):
     def changeHue(self, hue_shift):
         """Shift the hue of the image by hue_shift degrees (0-360)."""
         if not self.image.isNull():
-            # Convert image to RGB32 format for consistent color manipulation
-            hue_image = self.image.convertToFormat(QImage.Format_RGB32)
-            
-            for row_pixel in range(hue_image.width()):
-                for col_pixel in range(hue_image.height()):
-                    current_val = QColor(hue_image.pixel(row_pixel, col_pixel))
-                    # Shift hue while preserving saturation and value
-                    hue = (current_val.hue() + hue_shift) % 360
-                    current_val.setHsv(hue, current_val.saturation(), current_val.value(), current_val.alpha())
-                    hue_image.setPixelColor(row_pixel, col_pixel, current_val)
-            
-            # Update the image and pixmap
-            self.image = hue_image
-            self.setPixmap(QPixmap.fromImage(self.image))
-            self.repaint()
+            self.showImage(operations.hue(self.image, hue_shift))
+
+    def setAdjustments(self, source, values, run):
+        """Record the slider values applied over source in run and move the sliders to match."""
+        self.adjustments.source = source
+        self.adjustments.run = run
+        self.adjustments.values = dict(values)
+        self.parent.updateSliders()
+
+    def previewAdjustments(self, name, value, size):
+        """Show the effect of setting one slider value on a proxy of at most size, leaving self.image alone."""
+        layer = self.adjustments
+        source = self.image if layer.source is None else layer.source.restore()
+        values = dict(layer.values)
+        values[name] = value
+        self.showing_preview = True
+        self.scheduleRender(layer.preview(source, values, size))
+
+    def flattenAdjustments(self):
+        """Keep the adjusted pixels as they are and start a fresh adjustment layer on top of them."""
+        if self.adjustments.source is not None:
+            self.adjustments.reset()
+            self.parent.updateSliders()
 
     def mousePressEvent(self, event):
         """Handle mouse press event."""
@@ -398,4 +427,24 @@ class imageLabel(QLabel):
                     int(self.crop_rect.width() / zoom_factor),
                     int(self.crop_rect.height() / zoom_factor)
                 )
-            self.rubber_band.hide()
\ No newline at end of file
+            # The band stays up while the selection is active; a click without a drag clears it
+            if self.selection().isEmpty():
+                self.clearSelection()
+
+    def resizeEvent(self, event):
+        """Keep the selection's band over the same pixels as the zoom changes."""
+        super().resizeEvent(event)
+        if self.rubber_band and self.rubber_band.isVisible():
+            zoom_factor = self.parent.zoom_factor
+            rect = self.crop_rect
+            self.rubber_band.setGeometry(QRect(int(rect.x() * zoom_factor), int(rect.y() * zoom_factor),
+                                               int(rect.width() * zoom_factor), int(rect.height() * zoom_factor)))
+
+    def selection(self):
+        """The selected rectangle in image pixels, or an empty rectangle if nothing is selected."""
+        return self.crop_rect.intersected(self.image.rect())
+
+    def clearSelection(self):
+        self.crop_rect = QRect()
+        if self.rubber_band:
+            self.rubber_band.hide()
@@ -0,0 +1,73 @@
+# src/large_image.py
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QGridLayout, QLabel, QRadioButton,
+                             QComboBox, QSpinBox, QPushButton)
+from PyQt5.QtCore import QRect
+from .image_io import proxy_size
+
+PROXY_SCALES = (2, 4, 8)
+
+class LargeImageDialog(QDialog):
+    """Asks how to open an image too large to edit comfortably: full size, as a proxy or one region."""
+    def __init__(self, file_name, info, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Open Large Image")
+        self.image_size = info.size
+        self.setupUI(file_name, info)
+
+    def setupUI(self, file_name, info):
+        """Set up the three choices and their settings."""
+        layout = QVBoxLayout()
+        width, height = self.image_size.width(), self.image_size.height()
+        layout.addWidget(QLabel(f"{file_name}\n{width} x {height} pixels ({width * height / 1e6:.0f} MP, "
+                                f"{info.format.upper()}), {width * height * 4 / 2**20:.0f} MB once decoded."))
+
+        self.full_button = QRadioButton("Full size")
+        layout.addWidget(self.full_button)
+
+        proxy_layout = QHBoxLayout()
+        self.proxy_button = QRadioButton("Proxy at")
+        self.proxy_button.setChecked(True)
+        self.scale_box = QComboBox()
+        for scale in PROXY_SCALES:
+            size = proxy_size(self.image_size, scale)
+            self.scale_box.addItem(f"1/{scale} ({size.width()} x {size.height()})", scale)
+        self.scale_box.setCurrentIndex(1)
+        self.scale_box.activated.connect(lambda: self.proxy_button.setChecked(True))
+        proxy_layout.addWidget(self.proxy_button)
+        proxy_layout.addWidget(self.scale_box, 1)
+        layout.addLayout(proxy_layout)
+
+        self.region_button = QRadioButton("Region")
+        layout.addWidget(self.region_button)
+        region_grid = QGridLayout()
+        self.region_boxes = []
+        limits = (width - 1, height - 1, width, height)
+        defaults = (0, 0, min(width, 4096), min(height, 4096))
+        for column, (title, limit, default) in enumerate(zip(("X", "Y", "Width", "Height"), limits, defaults)):
+            spin_box = QSpinBox()
+            spin_box.setRange(0 if column < 2 else 1, limit)
+            spin_box.setValue(default)
+            spin_box.valueChanged.connect(lambda: self.region_button.setChecked(True))
+            region_grid.addWidget(QLabel(title), 0, column)
+            region_grid.addWidget(spin_box, 1, column)
+            self.region_boxes.append(spin_box)
+        layout.addLayout(region_grid)
+
+        button_layout = QHBoxLayout()
+        open_button = QPushButton("Open")
+        open_button.clicked.connect(self.accept)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.reject)
+        button_layout.addWidget(open_button)
+        button_layout.addWidget(cancel_button)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def getOptions(self):
+        """Return (scaled_size, clip_rect) for read_image; None means full size or the whole image."""
+        if self.proxy_button.isChecked():
+            return proxy_size(self.image_size, self.scale_box.currentData()), None
+        if self.region_button.isChecked():
+            rect = QRect(*(spin_box.value() for spin_box in self.region_boxes))
+            return None, rect.intersected(QRect(0, 0, self.image_size.width(), self.image_size.height()))
+        return None, None
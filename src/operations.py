@@ -0,0 +1,92 @@
+# src/operations.py
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QTransform
+from .pixels import image_array, process_bands, to_working_format, working_format
+from .tone import apply_lut_array, brightness_lut, contrast_lut
+from .color_matrix import apply_color_matrix_array, GRAYSCALE, SEPIA
+from .hsv import shift_hsv_array
+
+# Every operation takes an image and returns a new one, leaving its input
+# untouched, so it is safe to run on a snapshot from a worker thread.
+# progress, where given, is called as progress(done, total).
+
+def point_operation(image, kernel, progress=None):
+    """Return a copy of image in the working format with kernel applied to its pixel array band by band."""
+    # One copy either way: converting makes a new buffer, and otherwise the shared one detaches
+    result = image.convertToFormat(working_format(image))
+    process_bands(image_array(result), kernel, progress)
+    return result
+
+def in_region(image, rect, operation, progress=None):
+    """Return image with operation(part, progress) applied to just the part of it inside rect.
+
+    Only the pixels inside rect are processed; the rest is copied across as is.
+    """
+    rect = rect.intersected(image.rect())
+    if rect.isEmpty():
+        return image
+    result = image.convertToFormat(working_format(image))
+    part = operation(image.copy(rect), progress).convertToFormat(result.format())
+    image_array(result)[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1] = \
+        image_array(part, writable=False)
+    return result
+
+def grayscale(image, progress=None):
+    """Grayscale in the working format, using the same weights as qGray(); alpha is kept."""
+    return point_operation(image, lambda pixels: apply_color_matrix_array(pixels, GRAYSCALE), progress)
+
+def sepia(image, progress=None):
+    """Classic sepia tone."""
+    return point_operation(image, lambda pixels: apply_color_matrix_array(pixels, SEPIA), progress)
+
+def mix_channels(image, matrix, progress=None):
+    """Recombine the red, green and blue channels with a 3x4 color matrix."""
+    return point_operation(image, lambda pixels: apply_color_matrix_array(pixels, matrix), progress)
+
+def brightness(image, value, progress=None):
+    """Add value to every channel."""
+    lut = brightness_lut(value)
+    return point_operation(image, lambda pixels: apply_lut_array(pixels, lut), progress)
+
+def contrast(image, value, progress=None):
+    """Stretch or squeeze every channel around mid-gray."""
+    lut = contrast_lut(value)
+    return point_operation(image, lambda pixels: apply_lut_array(pixels, lut), progress)
+
+def hue(image, hue_shift, progress=None):
+    """Shift the hue by hue_shift degrees."""
+    return point_operation(image, lambda pixels: shift_hsv_array(pixels, hue_shift), progress)
+
+def to_rgb(image, progress=None):
+    """Convert to the working format, RGB32 or ARGB32 with alpha; an image already in it is returned as is."""
+    return to_working_format(image)
+
+def rotate90(image, direction, progress=None):
+    """Rotate 90º clockwise ("cw") or counterclockwise ("ccw")."""
+    angle = 90 if direction == "cw" else -90
+    return image.transformed(QTransform().rotate(angle), Qt.SmoothTransformation)
+
+def flip(image, axis, progress=None):
+    """Mirror across the "horizontal" or "vertical" axis."""
+    return image.mirrored(axis == "horizontal", axis == "vertical")
+
+def resize_half(image, progress=None):
+    """Scale down to half the width and height."""
+    # Smooth scaling hands images with alpha back premultiplied
+    return to_working_format(image.transformed(QTransform().scale(0.5, 0.5), Qt.SmoothTransformation))
+
+def crop(image, rect, progress=None):
+    """Cut out rect."""
+    return image.copy(rect)
+
+def orient(image, turns, mirrored, progress=None):
+    """Rotate turns quarter turns clockwise, then mirror horizontally if mirrored; both are lossless."""
+    if turns % 4:
+        image = image.transformed(QTransform().rotate(90 * (turns % 4)))
+    if mirrored:
+        image = image.mirrored(True, False)
+    return image
+
+def curves(image, lut, progress=None):
+    """Map every channel through a 256-entry lookup table, or a (3, 256) red, green, blue one."""
+    return point_operation(image, lambda pixels: apply_lut_array(pixels, lut), progress)
@@ -0,0 +1,103 @@
+# src/pixels.py
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+import numpy as np
+from PyQt5.QtGui import QImage
+
+# Byte offset of each channel inside a 32-bit 0xAARRGGBB pixel in memory
+if sys.byteorder == "little":
+    BLUE, GREEN, RED, ALPHA = 0, 1, 2, 3
+else:
+    ALPHA, RED, GREEN, BLUE = 0, 1, 2, 3
+
+# Every image PicFix edits is kept in one of these formats from the moment it is
+# decoded: opaque images in RGB32, which the raster paint engine draws without
+# conversion, and images with transparency in ARGB32, whose unpremultiplied
+# color bytes the point kernels map directly while leaving alpha alone. Point
+# operations write the format they are given and geometric ones preserve it,
+# so no edit pays for a format change.
+WORKING_FORMAT = QImage.Format_RGB32
+ALPHA_WORKING_FORMAT = QImage.Format_ARGB32
+
+def working_format(image):
+    """The format image is edited in: ALPHA_WORKING_FORMAT if it has an alpha channel, else WORKING_FORMAT."""
+    return ALPHA_WORKING_FORMAT if image.hasAlphaChannel() else WORKING_FORMAT
+
+def to_working_format(image):
+    """Return image in its working format, sharing its pixels if it already is."""
+    target = working_format(image)
+    if image.format() == target:
+        return image
+    return image.convertToFormat(target)
+
+def image_array(image, writable=True):
+    """Return a (height, width, 4) uint8 view of a 32-bit QImage's pixel buffer.
+
+    A writable view detaches the image first, so writes never leak into
+    shared copies; a read-only view leaves shared pixels shared.
+    """
+    if image.depth() != 32:
+        raise ValueError("image_array() needs a 32-bit image")
+    ptr = image.bits() if writable else image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    pixels = np.ndarray((image.height(), image.width(), 4), dtype=np.uint8, buffer=ptr,
+                        strides=(image.bytesPerLine(), 4, 1))
+    if not writable:
+        pixels.flags.writeable = False
+    return pixels
+
+
+# Kernels that need float temporaries work on bands of about this many pixels
+CHUNK_PIXELS = 1 << 16
+
+def row_chunks(height, width, chunk_pixels=CHUNK_PIXELS):
+    """Yield (start, stop) row ranges covering an image in bands of about chunk_pixels."""
+    rows = max(1, chunk_pixels // max(width, 1))
+    for start in range(0, height, rows):
+        yield start, min(start + rows, height)
+
+# Whole-image operations report progress and check for cancellation once per band of about this many pixels
+BAND_PIXELS = 1 << 20
+
+# NumPy releases the GIL inside its loops, so bands of one shared buffer
+# run in parallel on threads without copying any pixels
+BAND_THREADS = os.cpu_count() or 1
+_band_executor = None
+
+def band_executor():
+    """Return the thread pool shared by every banded operation, starting it on first use."""
+    global _band_executor
+    if _band_executor is None:
+        _band_executor = ThreadPoolExecutor(max_workers=BAND_THREADS, thread_name_prefix="band")
+    return _band_executor
+
+def process_bands(pixels, kernel, progress=None):
+    """Run kernel in place over a (height, width, 4) pixel array, one band of rows per task.
+
+    Bands run in parallel on band_executor() and write straight into pixels.
+    progress, if given, is called as progress(done, total) on the calling
+    thread as bands complete; if it raises, bands not yet started are
+    cancelled and the exception is re-raised once running bands have stopped.
+    """
+    height, width = pixels.shape[:2]
+    bands = list(row_chunks(height, width, BAND_PIXELS))
+    if len(bands) == 1 or BAND_THREADS == 1:
+        for index, (start, stop) in enumerate(bands, start=1):
+            kernel(pixels[start:stop])
+            if progress is not None:
+                progress(index, len(bands))
+        return pixels
+    futures = [band_executor().submit(kernel, pixels[start:stop]) for start, stop in bands]
+    try:
+        for index, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            if progress is not None:
+                progress(index, len(bands))
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        # Running bands still write into pixels, so they must finish before the buffer can go
+        wait(futures)
+        raise
+    return pixels
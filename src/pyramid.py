@@ -0,0 +1,131 @@
+# src/pyramid.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage
+from .pixels import image_array, row_chunks
+
+_level_executor = None
+
+def level_executor():
+    """Return the thread that builds pyramid levels, starting it on first use.
+
+    It is kept apart from band_executor(), so a paint never waits behind the
+    bands of a running command.
+    """
+    global _level_executor
+    if _level_executor is None:
+        _level_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyramid")
+    return _level_executor
+
+def halve_into(source, target):
+    """Write the 2x2 box average of source, a (height, width, 4) array, into target of half its size.
+
+    A trailing odd row or column of source is left out.
+    """
+    height, width = target.shape[:2]
+
+    def kernel(rows):
+        start, stop = rows
+        total = source[2 * start:2 * stop:2, 0:2 * width:2].astype(np.uint16)
+        total += source[2 * start + 1:2 * stop:2, 0:2 * width:2]
+        total += source[2 * start:2 * stop:2, 1:2 * width:2]
+        total += source[2 * start + 1:2 * stop:2, 1:2 * width:2]
+        total += 2
+        total >>= 2
+        target[start:stop] = total
+
+    # Bands keep the uint16 temporaries small
+    for rows in row_chunks(height, width):
+        kernel(rows)
+    return target
+
+class ImagePyramid:
+    """Copies of an image at 1/2, 1/4, 1/8... of its size, each built in the background the first time it is asked for.
+
+    Each level is the box average of the one above it, so a change to part
+    of the image only needs the same part of each built level redone.
+    built, if given, is called on the pyramid thread whenever a new level is
+    ready.
+    """
+    def __init__(self, image=None, built=None):
+        self.built = built
+        # Guards levels against a build finishing while the GUI thread changes the image
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.reset(QImage() if image is None else image)
+
+    def reset(self, image):
+        """Start over from image, dropping every level built so far."""
+        with self.lock:
+            self.image = image
+            self.levels = {}  # divisor -> QImage
+            self._restart()
+
+    def _restart(self):
+        # Builds started before now work from stale pixels, so their levels are thrown away
+        self.generation += 1
+        self.requested = set()
+
+    def update(self, image, rect):
+        """Take image, which differs from the current image only inside rect, and refresh the built levels."""
+        with self.lock:
+            self.image = image
+            self._restart()
+            parent = image
+            for divisor in sorted(self.levels):
+                level = self.levels[divisor]
+                # The pixels of this level that average changed pixels of its parent
+                rect = QRect(rect.left() // 2, rect.top() // 2,
+                             rect.right() // 2 - rect.left() // 2 + 1,
+                             rect.bottom() // 2 - rect.top() // 2 + 1).intersected(level.rect())
+                if rect.isEmpty():
+                    break
+                x, y, width, height = rect.x(), rect.y(), rect.width(), rect.height()
+                halve_into(image_array(parent, writable=False)[2 * y:2 * (y + height), 2 * x:2 * (x + width)],
+                           image_array(level)[y:y + height, x:x + width])
+                parent = level
+                if divisor * 2 not in self.levels:
+                    break
+
+    def level(self, scale):
+        """Return (image, divisor): the smallest level still at least scale times the image's size.
+
+        A level not built yet is started in the background, and the nearest
+        larger level built so far, at worst the image itself, is returned
+        meanwhile.
+        """
+        divisor = 1
+        if self.image.depth() == 32:
+            while (scale * divisor * 2 <= 1 and self.image.width() >= divisor * 2
+                   and self.image.height() >= divisor * 2):
+                divisor *= 2
+        with self.lock:
+            if divisor > 1 and divisor not in self.levels and divisor not in self.requested:
+                self.requested.add(divisor)
+                level_executor().submit(self._build, divisor, self.generation)
+            while divisor > 1 and divisor not in self.levels:
+                divisor //= 2
+            return (self.levels[divisor] if divisor > 1 else self.image), divisor
+
+    def _build(self, divisor, generation):
+        """Build the level for divisor and any missing ones above it, on the pyramid thread."""
+        with self.lock:
+            if generation != self.generation:
+                return
+            parent_divisor = divisor // 2
+            while parent_divisor > 1 and parent_divisor not in self.levels:
+                parent_divisor //= 2
+            parent = self.levels[parent_divisor] if parent_divisor > 1 else self.image
+        while parent_divisor < divisor:
+            level = QImage(parent.width() // 2, parent.height() // 2, parent.format())
+            halve_into(image_array(parent, writable=False), image_array(level))
+            parent_divisor *= 2
+            with self.lock:
+                if generation != self.generation:
+                    return
+                self.levels[parent_divisor] = level
+            parent = level
+        if self.built is not None:
+            self.built()
@@ -0,0 +1,134 @@
+# src/recipes.py
+import json
+import numpy as np
+from PyQt5.QtCore import QRect
+from . import operations
+from .adjustments import render_adjustments
+from .tone import brightness_lut, compose_luts, contrast_lut
+
+RECIPE_VERSION = 1
+
+# A recipe is {"version": 1, "steps": [...]}, each step a dict with an "op"
+# key plus that operation's parameters. "adjust" holds the full slider
+# values, rendered over the image as it was before a run of adjust steps;
+# steps of one run share its "run" id.
+# A point operation may carry "region": [x, y, width, height] to apply only
+# inside that rectangle.
+STEPS = {
+    "brightness": lambda image, step, progress: operations.brightness(image, step["value"], progress),
+    "contrast": lambda image, step, progress: operations.contrast(image, step["value"], progress),
+    "hue": lambda image, step, progress: operations.hue(image, step["value"], progress),
+    "adjust": lambda image, step, progress: render_adjustments(
+        image, step.get("brightness", 0), step.get("contrast", 0), step.get("hue", 0), progress),
+    "sepia": lambda image, step, progress: operations.sepia(image, progress),
+    "grayscale": lambda image, step, progress: operations.grayscale(image, progress),
+    "rgb": lambda image, step, progress: operations.to_rgb(image, progress),
+    "mix": lambda image, step, progress: operations.mix_channels(image, step["matrix"], progress),
+    "rotate": lambda image, step, progress: operations.rotate90(image, step["direction"], progress),
+    "flip": lambda image, step, progress: operations.flip(image, step["axis"], progress),
+    "orient": lambda image, step, progress: operations.orient(image, step["turns"], step["mirrored"], progress),
+    "crop": lambda image, step, progress: operations.crop(
+        image, QRect(step["x"], step["y"], step["width"], step["height"]), progress),
+    "resize": lambda image, step, progress: operations.resize_half(image, progress),
+    "curves": lambda image, step, progress: operations.curves(
+        image, np.asarray(step["table"], dtype=np.uint8), progress),
+}
+
+def recipe_from_commands(commands):
+    """Build a recipe from an undo stack, oldest command first; commands that don't edit pixels are left out."""
+    steps = []
+    for command in commands:
+        steps.extend(command.recipeSteps())
+    return {"version": RECIPE_VERSION, "steps": steps}
+
+def save_recipe(recipe, file_name):
+    with open(file_name, "w") as recipe_file:
+        json.dump(recipe, recipe_file, separators=(",", ":"))
+
+def load_recipe(file_name):
+    """Read a recipe file and check every step names a known operation."""
+    with open(file_name) as recipe_file:
+        recipe = json.load(recipe_file)
+    if recipe.get("version") != RECIPE_VERSION:
+        raise ValueError(f"Unsupported recipe version: {recipe.get('version')}")
+    for step in recipe["steps"]:
+        if step.get("op") not in STEPS:
+            raise ValueError(f"Unknown recipe step: {step.get('op')}")
+    return recipe
+
+def _orientation(turns, mirrored, step):
+    """Compose one rotate or flip step after (turns, mirrored), where mirroring follows the turns."""
+    # Mirroring reverses the direction of any later rotation
+    sign = -1 if mirrored else 1
+    if step["op"] == "rotate":
+        return turns + sign * (1 if step["direction"] == "cw" else -1), mirrored
+    if step["op"] == "orient":
+        turns, mirrored = turns + sign * step["turns"], mirrored
+        return turns, mirrored != step["mirrored"]
+    if step["axis"] == "horizontal":
+        return turns, not mirrored
+    # A vertical flip is a horizontal one after a half turn
+    return turns + 2, not mirrored
+
+def _tone_lut(step):
+    if step["op"] == "brightness":
+        return brightness_lut(step["value"])
+    if step["op"] == "contrast":
+        return contrast_lut(step["value"])
+    return np.asarray(step["table"], dtype=np.uint8)
+
+def _merge(first, second):
+    """Return one step equivalent to first then second, or None if they don't combine."""
+    geometric = ("rotate", "flip", "orient")
+    tone = ("brightness", "contrast", "curves")
+    if first["op"] in geometric and second["op"] in geometric:
+        turns, mirrored = _orientation(0, False, first)
+        turns, mirrored = _orientation(turns, mirrored, second)
+        return {"op": "orient", "turns": turns % 4, "mirrored": mirrored}
+    if first["op"] in tone and second["op"] in tone:
+        if first["op"] == second["op"] == "brightness" and (first["value"] >= 0) == (second["value"] >= 0):
+            # Same-direction shifts clip at the same end, so they simply add up
+            return {"op": "brightness", "value": first["value"] + second["value"]}
+        return {"op": "curves", "table": compose_luts(_tone_lut(first), _tone_lut(second)).tolist()}
+    if first["op"] == second["op"] == "hue":
+        return {"op": "hue", "value": (first["value"] + second["value"]) % 360}
+    if first["op"] == second["op"] == "adjust" and first.get("run") == second.get("run"):
+        # Every adjust step of a run renders from the same source, so only the last one counts.
+        # Adjacent runs are separate edits, the second rendered over the first.
+        return second
+    if first["op"] == second["op"] == "crop":
+        if (second["x"] >= 0 and second["y"] >= 0 and second["x"] + second["width"] <= first["width"]
+                and second["y"] + second["height"] <= first["height"]):
+            return dict(second, x=first["x"] + second["x"], y=first["y"] + second["y"])
+    return None
+
+def optimize_steps(steps):
+    """Merge adjacent steps that combine into one, such as rotations and flips or stacked tone changes."""
+    merged = []
+    for step in steps:
+        # Only steps over the same pixels combine
+        combined = _merge(merged[-1], step) if merged and merged[-1].get("region") == step.get("region") else None
+        if combined is None:
+            merged.append(step)
+        else:
+            if "region" in step:
+                combined = dict(combined, region=step["region"])
+            merged[-1] = combined
+    # Orientations that cancel out drop away entirely
+    return [step for step in merged if not (step["op"] == "orient" and step["turns"] == 0 and not step["mirrored"])]
+
+def apply_recipe(image, recipe, progress=None):
+    """Return image with every step of recipe applied, after merging the steps that combine.
+
+    progress, if given, is called as progress(done, total) after each step.
+    """
+    steps = optimize_steps(recipe["steps"])
+    for index, step in enumerate(steps, start=1):
+        if "region" in step:
+            image = operations.in_region(image, QRect(*step["region"]),
+                                         lambda part, _: STEPS[step["op"]](part, step, None))
+        else:
+            image = STEPS[step["op"]](image, step, None)
+        if progress is not None:
+            progress(index, len(steps))
+    return image
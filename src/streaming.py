@@ -0,0 +1,366 @@
+# src/streaming.py
+import struct
+import zlib
+import numpy as np
+from PyQt5.QtGui import QImage
+from .pixels import BLUE, GREEN, RED, ALPHA, image_array
+from .recipes import RECIPE_VERSION, apply_recipe, optimize_steps
+
+# Images are streamed through memory in strips of about this many bytes of RGB32 pixels
+STRIP_BYTES = 64 * 1024 * 1024
+# Recipe steps that map each pixel on its own, so a strip can be processed without its neighbours
+POINT_STEPS = {"brightness", "contrast", "hue", "adjust", "sepia", "grayscale", "rgb", "mix", "curves"}
+STREAM_EXTENSIONS = (".bmp", ".png")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Compressed PNG data is written out in IDAT chunks of about this size
+PNG_CHUNK_BYTES = 1024 * 1024
+# Bytes per pixel of each 8-bit PNG color type
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+class UnsupportedImage(ValueError):
+    """Raised when a file is a kind or variant of image the strip readers and writers do not handle."""
+
+def is_streamable(recipe):
+    """True if every step of recipe is a point operation on the whole image."""
+    # A region is in whole-image pixels, which a strip does not know about
+    return all(step["op"] in POINT_STEPS and "region" not in step for step in recipe["steps"])
+
+def can_stream(source, target, recipe):
+    """True if source can be streamed through recipe into target."""
+    return (is_streamable(recipe) and source.lower().endswith(STREAM_EXTENSIONS)
+            and target.lower().endswith(STREAM_EXTENSIONS))
+
+def _to_pixels(rgb, alpha=None):
+    """Pack (rows, width, 3) red, green, blue bytes and optional alpha into RGB32 pixel order."""
+    pixels = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+    pixels[..., RED] = rgb[..., 0]
+    pixels[..., GREEN] = rgb[..., 1]
+    pixels[..., BLUE] = rgb[..., 2]
+    pixels[..., ALPHA] = 255 if alpha is None else alpha
+    return pixels
+
+class BmpStripReader:
+    """Reads an uncompressed 24 or 32-bit BMP a strip of rows at a time."""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = f.read(70)
+        if header[:2] != b"BM":
+            raise UnsupportedImage("not a BMP file")
+        offset, header_size = struct.unpack_from("<II", header, 10)
+        self.width, height, _, self.bits, compression = struct.unpack_from("<iiHHI", header, 18)
+        # Compression 3 (bitfields) is how 32-bit BMPs usually declare their standard BGRA masks
+        if self.bits not in (24, 32) or compression not in (0, 3):
+            raise UnsupportedImage("only uncompressed 24 and 32-bit BMPs can be streamed")
+        # Headers from version 3 on give an alpha mask after the color masks, which Qt honours
+        self.has_alpha = (self.bits == 32 and compression == 3 and header_size >= 56
+                          and struct.unpack_from("<I", header, 66)[0] != 0)
+        # Positive heights are stored bottom row first
+        self.bottom_up = height > 0
+        self.height = abs(height)
+        self.offset = offset
+        self.stride = (self.bits * self.width + 31) // 32 * 4
+        # Plain reads rather than a memory map, whose pages would count against the process until evicted
+        self.file = open(path, "rb")
+
+    def read(self, start, stop):
+        """Return rows start to stop as a (rows, width, 4) RGB32 pixel array."""
+        first = self.height - stop if self.bottom_up else start
+        self.file.seek(self.offset + first * self.stride)
+        rows = np.empty((stop - start, self.stride), dtype=np.uint8)
+        if self.file.readinto(rows) != rows.nbytes:
+            raise ValueError("BMP data ends early")
+        if self.bottom_up:
+            rows = rows[::-1]
+        channels = self.bits // 8
+        bgr = rows[:, :self.width * channels].reshape(stop - start, self.width, channels)
+        return _to_pixels(bgr[..., 2::-1], bgr[..., 3] if self.has_alpha else None)
+
+    def close(self):
+        self.file.close()
+
+class PngStripReader:
+    """Decodes a non-interlaced 8 or 16-bit PNG one strip of rows at a time."""
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        if self.file.read(8) != PNG_SIGNATURE:
+            raise UnsupportedImage("not a PNG file")
+        self.palette = None
+        kind, data = self._next_chunk()
+        self.width, self.height, self.depth, self.color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+        if self.depth not in (8, 16) or self.color_type not in PNG_CHANNELS or interlace:
+            raise UnsupportedImage("only non-interlaced 8 and 16-bit PNGs can be streamed")
+        self.pixel_bytes = PNG_CHANNELS[self.color_type] * self.depth // 8
+        self.stride = self.width * self.pixel_bytes
+        self.transparency = None
+        # Whether the image has alpha must be known before the writer opens, so chunks up to the data are read now
+        self.first_data = self._compressed()
+        self.has_alpha = self.color_type in (4, 6) or self.transparency is not None
+        self.decompressor = zlib.decompressobj()
+        self.pending = b""
+        self.previous = np.zeros(self.stride, dtype=np.uint8)
+        self.next_row = 0
+
+    def _next_chunk(self):
+        length, kind = struct.unpack(">I4s", self.file.read(8))
+        data = self.file.read(length)
+        self.file.read(4)  # CRC
+        return kind, data
+
+    def _compressed(self):
+        """Return the next IDAT payload, reading past the chunks before it, or b"" at the end."""
+        while True:
+            kind, data = self._next_chunk()
+            if kind == b"PLTE":
+                self.palette = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+            elif kind == b"tRNS":
+                self.transparency = data
+            elif kind == b"IDAT":
+                return data
+            elif kind == b"IEND":
+                return b""
+
+    def _filtered_rows(self, count):
+        """Return the next count filtered rows, each a filter byte followed by stride bytes."""
+        needed = count * (self.stride + 1)
+        parts = [self.pending]
+        have = len(self.pending)
+        while have < needed:
+            data = self.decompressor.unconsumed_tail
+            if not data:
+                if self.first_data is not None:
+                    data, self.first_data = self.first_data, None
+                else:
+                    data = self._compressed()
+                if not data:
+                    raise ValueError("PNG data ends early")
+            # Inflate no more than the strip needs, so one huge IDAT chunk cannot balloon memory
+            data = self.decompressor.decompress(data, needed - have)
+            parts.append(data)
+            have += len(data)
+        buffer = b"".join(parts)
+        self.pending = buffer[needed:]
+        return np.frombuffer(buffer, dtype=np.uint8, count=needed).reshape(count, self.stride + 1)
+
+    def _unfilter(self, kinds, filtered, previous):
+        """Undo the filters of rows of filtered bytes with the given filter types, following row previous."""
+        if (kinds > 4).any():
+            raise ValueError(f"unknown PNG filter type {kinds.max()}")
+        step = self.pixel_bytes
+        if (kinds < 3).all():
+            rows = np.empty(filtered.shape, dtype=np.uint8)
+            for index, kind in enumerate(kinds):
+                row = filtered[index]
+                if kind == 0:
+                    rows[index] = row
+                elif kind == 1:
+                    # Each byte adds the one a pixel to its left; a wrapping running sum per channel undoes that
+                    rows[index] = np.cumsum(row.reshape(-1, step), axis=0, dtype=np.uint8).ravel()
+                else:
+                    rows[index] = row + previous
+                previous = rows[index]
+            return rows
+        return self._unfilter_diagonals(kinds, filtered, previous)
+
+    def _unfilter_diagonals(self, kinds, filtered, previous):
+        """Undo any mix of filters, sweeping the strip one anti-diagonal of pixels at a time.
+
+        Average and Paeth predict each pixel from the decoded ones to its left,
+        above and above-left, so a row cannot be decoded in one vector step.
+        The pixels on one anti-diagonal depend only on earlier diagonals,
+        though, and in a buffer padded with one zero column each diagonal is
+        an evenly strided slice, so each is decoded in one step.
+        """
+        count, step, width = len(kinds), self.pixel_bytes, self.width
+        padded_width = width + 1
+        # Row 0 holds the previous row and column 0 the zeros left of each row
+        decoded = np.zeros((count + 1, padded_width, step), dtype=np.uint8)
+        decoded[0, 1:] = previous.reshape(width, step)
+        flat = decoded.reshape(-1, step)
+        source = np.ascontiguousarray(filtered).reshape(-1, step)
+        # Pixel (row, column) sits at row * padded_width + column + padded_width + 1 in flat and at
+        # row * width + column in source, so along a diagonal they step by width and width - 1
+        source_step = max(width - 1, 1)
+        # Strips usually use one or two filter types, so only their predictions are computed
+        used = np.unique(kinds).tolist()
+        for diagonal in range(count + width - 1):
+            first, last = max(0, diagonal - width + 1), min(count - 1, diagonal)
+            cells = last - first + 1
+            at = first * width + diagonal + padded_width + 1
+            span = (cells - 1) * width + 1
+            left, up, upper_left = (flat[at - offset:at - offset + span:width].astype(np.int16)
+                                    for offset in (1, padded_width, padded_width + 1))
+            at_source = first * source_step + diagonal
+            filtered_bytes = source[at_source:at_source + (cells - 1) * source_step + 1:source_step]
+            predictions = {0: 0, 1: left, 2: up}
+            if 3 in used:
+                predictions[3] = (left + up) >> 1
+            if 4 in used:
+                to_left, to_up = np.abs(up - upper_left), np.abs(left - upper_left)
+                to_upper_left = np.abs(left + up - 2 * upper_left)
+                predictions[4] = np.where((to_left <= to_up) & (to_left <= to_upper_left), left,
+                                          np.where(to_up <= to_upper_left, up, upper_left))
+            if len(used) == 1:
+                predicted = predictions[used[0]]
+            else:
+                kind = kinds[first:last + 1, None]
+                predicted = np.zeros_like(left)
+                for used_kind in used:
+                    np.copyto(predicted, predictions[used_kind], where=kind == used_kind)
+            flat[at:at + span:width] = (filtered_bytes + predicted).astype(np.uint8)
+        return decoded[1:, 1:].reshape(count, -1)
+
+    def read(self, start, stop):
+        """Return rows start to stop, which must follow the rows already read, as RGB32 pixels."""
+        if start != self.next_row:
+            raise ValueError("PNG strips must be read in order")
+        filtered = self._filtered_rows(stop - start)
+        rows = self._unfilter(filtered[:, 0], filtered[:, 1:], self.previous)
+        self.previous = rows[-1].copy()
+        self.next_row = stop
+        samples = rows.reshape(stop - start, self.width, -1)
+        alpha = None
+        if self.transparency is not None and self.color_type in (0, 2):
+            # tRNS gives the one sample value, full depth, that is fully transparent
+            key = np.frombuffer(self.transparency, dtype=">u2")[:1 if self.color_type == 0 else 3]
+            full = samples.view(">u2") if self.depth == 16 else samples
+            alpha = np.where((full == key).all(axis=-1), 0, 255).astype(np.uint8)
+        if self.depth == 16:
+            # Keep the high byte of each big-endian sample
+            samples = samples[..., 0::2]
+        if self.color_type == 3:
+            if self.transparency is not None:
+                # tRNS lists the alpha of the first palette entries; the rest are opaque
+                table = np.full(len(self.palette), 255, dtype=np.uint8)
+                entries = np.frombuffer(self.transparency, dtype=np.uint8)[:len(table)]
+                table[:len(entries)] = entries
+                alpha = table[samples[..., 0]]
+            return _to_pixels(self.palette[samples[..., 0]], alpha)
+        if self.color_type in (0, 4):
+            gray = samples[..., 0]
+            if alpha is not None:
+                # Qt decodes the transparent gray as transparent black
+                gray = np.where(alpha == 0, 0, gray).astype(np.uint8)
+            return _to_pixels(np.stack([gray, gray, gray], axis=-1),
+                              samples[..., 1] if self.color_type == 4 else alpha)
+        return _to_pixels(samples[..., :3], samples[..., 3] if self.color_type == 6 else alpha)
+
+    def close(self):
+        self.file.close()
+
+class BmpStripWriter:
+    """Writes a 24-bit BMP strip by strip, seeking to where each bottom-up strip belongs.
+
+    Like Qt's own BMP writer, it drops alpha.
+    """
+    def __init__(self, path, width, height, alpha=False):
+        self.width, self.height = width, height
+        self.stride = (24 * width + 31) // 32 * 4
+        size = 54 + self.stride * height
+        self.file = open(path, "wb")
+        # Sizes past 4 GB do not fit the header; readers take them from the dimensions instead
+        self.file.write(struct.pack("<2sIHHI", b"BM", size if size < 2**32 else 0, 0, 0, 54))
+        self.file.write(struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, 0, 2835, 2835, 0, 0))
+        self.file.truncate(size)
+
+    def write(self, start, pixels):
+        """Write pixels, a (rows, width, 4) RGB32 array, as rows start onwards."""
+        rows = np.zeros((len(pixels), self.stride), dtype=np.uint8)
+        bgr = rows[:, :self.width * 3].reshape(len(pixels), self.width, 3)
+        bgr[..., 0], bgr[..., 1], bgr[..., 2] = pixels[..., BLUE], pixels[..., GREEN], pixels[..., RED]
+        # The file's first row is the image's last, so the strip goes in reversed
+        self.file.seek(54 + (self.height - start - len(pixels)) * self.stride)
+        self.file.write(rows[::-1].tobytes())
+
+    def close(self):
+        self.file.close()
+
+class PngStripWriter:
+    """Encodes an 8-bit RGB PNG, or RGBA with alpha, strip by strip, streaming compressed rows out in IDAT chunks."""
+    def __init__(self, path, width, height, alpha=False):
+        self.width = width
+        self.channels = [RED, GREEN, BLUE, ALPHA] if alpha else [RED, GREEN, BLUE]
+        self.file = open(path, "wb")
+        self.file.write(PNG_SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6 if alpha else 2, 0, 0, 0))
+        self.compressor = zlib.compressobj(6)
+        self.pending = []
+        self.pending_bytes = 0
+        self.previous = np.zeros(width * len(self.channels), dtype=np.uint8)
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack(">I", len(data)) + kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def _flush(self, data, final=False):
+        if data:
+            self.pending.append(data)
+            self.pending_bytes += len(data)
+        if self.pending_bytes >= PNG_CHUNK_BYTES or (final and self.pending):
+            self._chunk(b"IDAT", b"".join(self.pending))
+            self.pending = []
+            self.pending_bytes = 0
+
+    def write(self, start, pixels):
+        """Write pixels, a (rows, width, 4) RGB32 array, as the next rows."""
+        samples = pixels[..., self.channels].reshape(len(pixels), -1)
+        # The Up filter compresses photos well and, unlike Sub or Paeth, vectorizes across a whole strip
+        filtered = np.empty((len(pixels), samples.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        filtered[0, 1:] = samples[0] - self.previous
+        filtered[1:, 1:] = samples[1:] - samples[:-1]
+        self.previous = samples[-1].copy()
+        self._flush(self.compressor.compress(filtered.tobytes()))
+
+    def close(self):
+        self._flush(self.compressor.flush(), final=True)
+        self._chunk(b"IEND", b"")
+        self.file.close()
+
+def open_reader(path):
+    """Open a strip reader for path, chosen by its first bytes."""
+    with open(path, "rb") as f:
+        magic = f.read(8)
+    if magic == PNG_SIGNATURE:
+        return PngStripReader(path)
+    if magic[:2] == b"BM":
+        return BmpStripReader(path)
+    raise UnsupportedImage("only BMP and PNG images can be streamed")
+
+def open_writer(path, width, height, alpha=False):
+    """Open a strip writer for path, chosen by its extension, keeping alpha where the format can."""
+    if path.lower().endswith(".png"):
+        return PngStripWriter(path, width, height, alpha)
+    if path.lower().endswith(".bmp"):
+        return BmpStripWriter(path, width, height, alpha)
+    raise UnsupportedImage("only BMP and PNG images can be streamed")
+
+def stream_recipe(source, target, recipe, strip_bytes=STRIP_BYTES, progress=None):
+    """Apply a recipe of point operations to source strip by strip, writing the result to target.
+
+    Only about one strip of strip_bytes is in memory at a time, however
+    large the image. Returns the (width, height) of the image.
+    """
+    if not is_streamable(recipe):
+        raise ValueError("only point operations can be streamed")
+    # Merge the steps once rather than for every strip
+    recipe = {"version": RECIPE_VERSION, "steps": optimize_steps(recipe["steps"])}
+    reader = open_reader(source)
+    width, height = reader.width, reader.height
+    rows = max(1, strip_bytes // (4 * width))
+    try:
+        writer = open_writer(target, width, height, reader.has_alpha)
+        try:
+            for start in range(0, height, rows):
+                stop = min(start + rows, height)
+                pixels = reader.read(start, stop)
+                strip = QImage(pixels.data, width, stop - start, 4 * width, QImage.Format_ARGB32)
+                result = apply_recipe(strip, recipe)
+                writer.write(start, image_array(result, writable=False))
+                if progress is not None:
+                    progress(stop, height)
+        finally:
+            writer.close()
+    finally:
+        reader.close()
+    return width, height
@@ -0,0 +1,73 @@
+# src/telemetry.py
+import os
+import sqlite3
+import sys
+import time
+from collections import deque, namedtuple
+from .database import TELEMETRY_COLUMNS, add_telemetry_events
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TelemetryEvent = namedtuple("TelemetryEvent", TELEMETRY_COLUMNS)
+
+# Events are written to the database this many at a time, or on the GUI's flush timer
+BATCH_SIZE = 32
+FLUSH_INTERVAL_MS = 5000
+RECENT_EVENTS = 200
+
+def current_rss():
+    """Resident set size of this process in bytes, or its peak where the current size is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class TelemetryRecorder:
+    """Keeps the recent timed commands in memory and writes them to the telemetry table in batches.
+
+    write(events) stores a batch; with write=None events are only kept in memory.
+    """
+    def __init__(self, username, write=add_telemetry_events):
+        self.username = username
+        self.write = write
+        self.pending = []
+        self.recent = deque(maxlen=RECENT_EVENTS)
+
+    def record(self, command, action, image, seconds, gui_seconds, allocated_bytes, undo_usage):
+        """Record one run of command; action is "execute", "undo" or "redo"."""
+        name = type(command).__name__
+        if name.endswith("Command"):
+            name = name[:-len("Command")]
+        event = TelemetryEvent(self.username, time.time(), name, action, image.width(), image.height(),
+                               seconds, gui_seconds, allocated_bytes, undo_usage[0], undo_usage[1],
+                               current_rss())
+        self.recent.append(event)
+        if self.write is not None:
+            self.pending.append(event)
+            if len(self.pending) >= BATCH_SIZE:
+                self.flush()
+        return event
+
+    def flush(self):
+        """Write the pending events to the database."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            self.write(batch)
+        except sqlite3.Error:
+            # Telemetry must never get in the way of editing, so a failed batch is dropped
+            pass
+
+    def slowest(self, count=10):
+        """The count slowest recent events, slowest first."""
+        return sorted(self.recent, key=lambda event: event.seconds, reverse=True)[:count]
@@ -0,0 +1,142 @@
+# src/thumbnails.py
+import hashlib
+import os
+import threading
+from PyQt5.QtCore import QObject, QRunnable, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader
+
+THUMBNAIL_SIZE = 128
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "picfix", "thumbnails")
+CACHE_BYTES = 256 * 1024 * 1024
+# Eviction frees space down to this fraction of the cap, so it does not run on every store
+EVICT_TO = 0.9
+CACHE_QUALITY = 85
+
+def decode_thumbnail(path, size=THUMBNAIL_SIZE):
+    """Decode path at reduced size so its longer side is at most size, or return a null image.
+
+    The JPEG reader scales while decoding, so a large photo never has to be
+    decoded at full resolution.
+    """
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    full = reader.size()
+    if full.isValid() and (full.width() > size or full.height() > size):
+        reader.setScaledSize(full.scaled(QSize(size, size), Qt.KeepAspectRatio))
+    image = reader.read()
+    if not image.isNull() and (image.width() > size or image.height() > size):
+        # Formats that ignore the scaled size, and rotated JPEGs, still need scaling down
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image
+
+class ThumbnailCache:
+    """Thumbnails on disk, keyed by path, modification time and file size, evicting the least recently used.
+
+    Reading a thumbnail marks it as used by touching its file, so the cache
+    needs no index of its own. Files that fail to decode are remembered, by
+    the same key, for the rest of the session rather than retried on every
+    repaint. Safe to use from several threads.
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+        self.failures = set()  # keys of files that could not be decoded
+
+    def _key(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}"
+
+    def _cache_path(self, path):
+        key = self._key(path)
+        if key is None:
+            return None
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".jpg")
+
+    def get(self, path):
+        """Return the cached thumbnail of path, or None if it is missing or path has changed since."""
+        cache_path = self._cache_path(path)
+        if cache_path is None or not os.path.exists(cache_path):
+            return None
+        image = QImage(cache_path)
+        if image.isNull():
+            return None
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return image
+
+    def put(self, path, image):
+        """Store the thumbnail of path, evicting the least recently used ones past the byte cap."""
+        cache_path = self._cache_path(path)
+        if cache_path is None or image.isNull():
+            return
+        # Write to a private name first so a reader never sees half a file
+        temporary = f"{cache_path}.{threading.get_ident()}.tmp"
+        if not image.save(temporary, "JPEG", CACHE_QUALITY):
+            return
+        os.replace(temporary, cache_path)
+        with self.lock:
+            self.total_bytes += os.path.getsize(cache_path)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                         for entry in os.scandir(self.directory) if entry.name.endswith(".jpg"))
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, cache_path in entries:
+            if self.total_bytes <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(cache_path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+
+    def thumbnail(self, path, size=THUMBNAIL_SIZE):
+        """Return the thumbnail of path from the cache, decoding and caching it first if needed.
+
+        A file that does not decode gives a null image, straight away once it has failed before.
+        """
+        key = self._key(path)
+        if key in self.failures:
+            return QImage()
+        image = self.get(path)
+        if image is None:
+            image = decode_thumbnail(path, size)
+            if not image.isNull():
+                self.put(path, image)
+            elif key is not None:
+                with self.lock:
+                    self.failures.add(key)
+        return image
+
+class ThumbnailSignals(QObject):
+    """Signals of a ThumbnailWorker, delivered on the GUI thread."""
+    loaded = pyqtSignal(int, str, QImage)  # generation, path, thumbnail (null if unreadable)
+
+class ThumbnailWorker(QRunnable):
+    """Fetches one thumbnail through the cache in a thread pool."""
+    def __init__(self, cache, path, generation):
+        super().__init__()
+        self.cache = cache
+        self.path = path
+        self.generation = generation
+        self.cancelled = False
+        self.signals = ThumbnailSignals()
+
+    def cancel(self):
+        """Skip the thumbnail if it has not been started yet."""
+        self.cancelled = True
+
+    def run(self):
+        if self.cancelled:
+            return
+        self.signals.loaded.emit(self.generation, self.path, self.cache.thumbnail(self.path))
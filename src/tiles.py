@@ -0,0 +1,69 @@
+# src/tiles.py
+from collections import OrderedDict
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QPixmap
+
+TILE_SIZE = 256
+# Tile pixmaps kept for repainting, whatever the size of the image
+CACHE_BYTES = 128 * 1024 * 1024
+
+class TileCache:
+    """Pixmaps of fixed-size tiles of an image's pyramid levels, made when first painted.
+
+    Only tiles that have been on screen are converted, and the least
+    recently painted ones are dropped past max_bytes. Each pixmap carries a
+    one-pixel margin of its neighbours, so smooth scaling shows no seams.
+    """
+    def __init__(self, max_bytes=CACHE_BYTES, tile_size=TILE_SIZE):
+        self.max_bytes = max_bytes
+        self.tile_size = tile_size
+        self.tiles = OrderedDict()  # (divisor, column, row) -> (pixmap, margin rect in level pixels)
+        self.total_bytes = 0
+
+    def clear(self):
+        self.tiles.clear()
+        self.total_bytes = 0
+
+    def invalidate(self, rect):
+        """Drop every tile showing any of rect, given in full-size image pixels."""
+        for key in list(self.tiles):
+            divisor = key[0]
+            level_rect = QRect(rect.left() // divisor, rect.top() // divisor,
+                               rect.right() // divisor - rect.left() // divisor + 1,
+                               rect.bottom() // divisor - rect.top() // divisor + 1)
+            if self.tiles[key][1].intersects(level_rect):
+                self._drop(key)
+
+    def visible(self, level, divisor, rect):
+        """Yield (tile rect, pixmap, tile rect within pixmap) for the tiles of level covering rect."""
+        size = self.tile_size
+        rect = rect.intersected(level.rect())
+        if rect.isEmpty():
+            return
+        for row in range(rect.top() // size, rect.bottom() // size + 1):
+            for column in range(rect.left() // size, rect.right() // size + 1):
+                tile_rect = QRect(column * size, row * size, size, size).intersected(level.rect())
+                pixmap, margin_rect = self._tile(level, divisor, column, row, tile_rect)
+                yield tile_rect, pixmap, tile_rect.translated(-margin_rect.topLeft())
+
+    def _tile(self, level, divisor, column, row, tile_rect):
+        key = (divisor, column, row)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+        margin_rect = tile_rect.adjusted(-1, -1, 1, 1).intersected(level.rect())
+        tile = (QPixmap.fromImage(level.copy(margin_rect)), margin_rect)
+        self.tiles[key] = tile
+        self.total_bytes += self._bytes(margin_rect)
+        while self.total_bytes > self.max_bytes and len(self.tiles) > 1:
+            self._drop(next(iter(self.tiles)))
+        return tile
+
+    def _drop(self, key):
+        _, margin_rect = self.tiles.pop(key)
+        self.total_bytes -= self._bytes(margin_rect)
+
+    @staticmethod
+    def _bytes(rect):
+        return rect.width() * rect.height() * 4
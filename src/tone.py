@@ -0,0 +1,68 @@
+# src/tone.py
+import numpy as np
+from .pixels import BLUE, GREEN, RED, ALPHA, image_array
+
+IDENTITY_LUT = np.arange(256, dtype=np.uint8)
+
+def brightness_lut(value):
+    """Lookup table that adds value to every channel, clamped to 0-255."""
+    return np.clip(np.arange(256) + value, 0, 255).astype(np.uint8)
+
+def contrast_lut(contrast):
+    """Lookup table for the classic contrast curve around mid-gray (-255 < contrast < 259)."""
+    factor = float(259 * (contrast + 255) / (255 * (259 - contrast)))
+    return np.array([max(0, min(255, int(factor * (level - 128) + 128))) for level in range(256)],
+                    dtype=np.uint8)
+
+def gamma_lut(gamma):
+    """Lookup table for a gamma curve; values above 1 brighten the midtones."""
+    levels = np.arange(256) / 255.0
+    return np.clip(np.rint(255 * levels ** (1.0 / gamma)), 0, 255).astype(np.uint8)
+
+def levels_lut(black=0, white=255, gamma=1.0, out_black=0, out_white=255):
+    """Lookup table mapping the input range black-white onto out_black-out_white."""
+    levels = np.clip((np.arange(256) - black) / max(white - black, 1), 0.0, 1.0)
+    levels = levels ** (1.0 / gamma)
+    return np.clip(np.rint(out_black + levels * (out_white - out_black)), 0, 255).astype(np.uint8)
+
+def _channel_luts(lut):
+    """Return lut as a (3, 256) array of red, green and blue tables."""
+    lut = np.asarray(lut, dtype=np.uint8)
+    return np.stack([lut, lut, lut]) if lut.ndim == 1 else lut
+
+def compose_luts(*luts):
+    """Fuse several lookup tables into one (3, 256) table that applies them left to right."""
+    result = _channel_luts(IDENTITY_LUT)
+    for lut in luts:
+        result = np.take_along_axis(_channel_luts(lut), result.astype(np.intp), axis=1)
+    return result
+
+def _pair_table(low_lut, high_lut):
+    """Build a 65536-entry table that maps two adjacent bytes at once."""
+    pairs = np.arange(65536, dtype=np.uint16).view(np.uint8).reshape(-1, 2)
+    mapped = np.empty_like(pairs)
+    mapped[:, 0] = low_lut[pairs[:, 0]]
+    mapped[:, 1] = high_lut[pairs[:, 1]]
+    return mapped.view(np.uint16).ravel()
+
+def apply_lut_array(pixels, lut):
+    """Apply lut in place to a (height, width, 4) pixel array.
+
+    lut is either one 256-entry table shared by red, green and blue, or a
+    (3, 256) array with separate tables in red, green, blue order. Alpha is
+    left untouched.
+    """
+    byte_luts = [None] * 4
+    byte_luts[RED], byte_luts[GREEN], byte_luts[BLUE] = _channel_luts(lut)
+    byte_luts[ALPHA] = IDENTITY_LUT
+    # Mapping two bytes per lookup halves the number of gathers over the buffer
+    pairs = pixels.view(np.uint16)
+    for index in range(2):
+        table = _pair_table(byte_luts[2 * index], byte_luts[2 * index + 1])
+        np.take(table, pairs[..., index], out=pairs[..., index], mode="clip")
+    return pixels
+
+def apply_lut(image, lut):
+    """Apply lut in place to a 32-bit QImage and return it."""
+    apply_lut_array(image_array(image), lut)
+    return image
@@ -0,0 +1,368 @@
+# src/undo_store.py
+import tempfile
+import threading
+import zlib
+import numpy as np
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage
+from .pixels import band_executor, image_array
+
+# Undo snapshots are held in memory up to MEMORY_BUDGET, then spilled to
+# temporary files up to DISK_BUDGET, after which the oldest steps are dropped
+MEMORY_BUDGET = 512 * 1024 * 1024
+DISK_BUDGET = 4 * 1024 * 1024 * 1024
+TILE_SIZE = 256
+COMPRESSION_LEVEL = 1
+
+# ReplayUndoStore checkpoints after this many commands, this many bytes of
+# processed pixels, or this many seconds of measured replay work
+CHECKPOINT_COMMANDS = 10
+CHECKPOINT_BYTES = 1024 * 1024 * 1024
+CHECKPOINT_SECONDS = 0.5
+
+def _pack_tile(previous, current, x, y, width, height):
+    """Compress one tile of previous, or return None if current still has the same pixels there."""
+    old = previous[y:y + height, x:x + width]
+    if np.array_equal(old, current[y:y + height, x:x + width]):
+        return None
+    return x, y, width, height, zlib.compress(np.ascontiguousarray(old), COMPRESSION_LEVEL)
+
+class UndoSnapshot:
+    """The pixels needed to get back to an earlier image from the image that replaced it.
+
+    When both images are 32-bit with the same size and format, only the tiles
+    that changed are kept, compressed; if rect is given, only the tiles over
+    it are compared. Other 32-bit images are kept as one compressed buffer,
+    and anything else as the image itself.
+    """
+    def __init__(self, previous, current, rect=None):
+        self._describe(previous)
+        if previous.isNull() or previous.depth() != 32:
+            # A share of its own, so isDetached() on the displayed image tells whether it is still shared
+            self.image = QImage(previous)
+        elif current.size() == previous.size() and current.format() == previous.format():
+            old = image_array(previous, writable=False)
+            new = image_array(current, writable=False)
+            rect = previous.rect() if rect is None else rect.intersected(previous.rect())
+            columns = range(rect.left() // TILE_SIZE * TILE_SIZE, rect.right() + 1, TILE_SIZE)
+            rows = range(rect.top() // TILE_SIZE * TILE_SIZE, rect.bottom() + 1, TILE_SIZE)
+            jobs = [(old, new, x, y, min(TILE_SIZE, self.width - x), min(TILE_SIZE, self.height - y))
+                    for y in rows for x in columns]
+            # zlib releases the GIL, so tiles compress in parallel on the band threads
+            packed = band_executor().map(lambda job: _pack_tile(*job), jobs)
+            self.tiles = [tile for tile in packed if tile is not None]
+        else:
+            ptr = previous.constBits()
+            ptr.setsize(previous.sizeInBytes())
+            self.data = zlib.compress(ptr, COMPRESSION_LEVEL)
+
+    def _describe(self, previous):
+        """Record the shape of previous and start with nothing stored."""
+        self.tiles = None
+        self.data = None
+        self.image = None
+        self.spill_file = None
+        self.width, self.height = previous.width(), previous.height()
+        self.format = previous.format()
+        self.bytes_per_line = previous.bytesPerLine()
+
+    def changed_rect(self):
+        """Bounding rectangle of the tiles that differ between the two images, or None if not known."""
+        if self.tiles is None:
+            return None
+        rect = QRect()
+        for tile in self.tiles:
+            rect = rect.united(QRect(*tile[:4]))
+        return rect
+
+    def memory_bytes(self):
+        """Bytes this snapshot holds in memory."""
+        if self.spill_file is not None:
+            return 0
+        if self.image is not None:
+            return self.image.sizeInBytes()
+        if self.tiles is not None:
+            return sum(len(tile[4]) for tile in self.tiles)
+        return len(self.data)
+
+    def disk_bytes(self):
+        """Bytes this snapshot occupies in its spill file."""
+        if self.spill_file is None:
+            return 0
+        return self.spill_file.seek(0, 2)
+
+    def spill(self):
+        """Move compressed pixels to a temporary file; images kept whole stay in memory."""
+        if self.spill_file is not None or self.image is not None:
+            return
+        self.spill_file = tempfile.TemporaryFile(prefix="picfix-undo-")
+        if self.tiles is not None:
+            index = []
+            for x, y, width, height, data in self.tiles:
+                index.append((x, y, width, height, self.spill_file.tell(), len(data)))
+                self.spill_file.write(data)
+            self.tiles = index
+        else:
+            self.spill_file.write(self.data)
+            self.data = len(self.data)
+
+    def _read(self, offset, length):
+        self.spill_file.seek(offset)
+        return self.spill_file.read(length)
+
+    def _write_tiles(self, pixels):
+        """Copy the stored tiles back into a (height, width, 4) pixel array."""
+        for tile in self.tiles:
+            x, y, width, height = tile[:4]
+            data = self._read(*tile[4:]) if self.spill_file is not None else tile[4]
+            pixels[y:y + height, x:x + width] = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(height, width, 4)
+
+    def restore(self, current):
+        """Return the earlier image, given the image that replaced it.
+
+        Stored tiles are written straight into current if nothing else shares
+        its pixels, and into a copy of it otherwise.
+        """
+        if self.image is not None:
+            return self.image
+        if self.tiles is None:
+            data = self._read(0, self.data) if self.spill_file is not None else self.data
+            return QImage(zlib.decompress(data), self.width, self.height,
+                          self.bytes_per_line, self.format).copy()
+        restored = current if current.isDetached() else QImage(current)
+        self._write_tiles(image_array(restored))
+        return restored
+
+class PatchSnapshot(UndoSnapshot):
+    """Every pixel of one rectangle as it was before an edit wrote over it in place."""
+    def __init__(self, image, before, rect):
+        # image is only described; its pixels may already hold the edit
+        self._describe(image)
+        pixels = image_array(before, writable=False)
+        self.tiles = [(rect.x() + x, rect.y() + y, min(TILE_SIZE, rect.width() - x), min(TILE_SIZE, rect.height() - y),
+                       zlib.compress(np.ascontiguousarray(pixels[y:y + TILE_SIZE, x:x + TILE_SIZE]), COMPRESSION_LEVEL))
+                      for y in range(0, rect.height(), TILE_SIZE) for x in range(0, rect.width(), TILE_SIZE)]
+
+class CropSnapshot(UndoSnapshot):
+    """Only the pixels a crop cut away: the strips of the earlier image around the crop rectangle."""
+    def __init__(self, previous, crop_rect):
+        self._describe(previous)
+        # Parts of crop_rect outside the image come back from the crop as padding
+        self.crop_rect = crop_rect
+        self.kept_rect = crop_rect.intersected(previous.rect())
+        if previous.isNull() or previous.depth() != 32:
+            self.image = QImage(previous)
+            return
+        pixels = image_array(previous, writable=False)
+        kept = self.kept_rect
+        strips = [(0, 0, self.width, kept.top()),
+                  (0, kept.bottom() + 1, self.width, self.height - kept.bottom() - 1),
+                  (0, kept.top(), kept.left(), kept.height()),
+                  (kept.right() + 1, kept.top(), self.width - kept.right() - 1, kept.height())]
+        self.tiles = [(x, y, width, height,
+                       zlib.compress(np.ascontiguousarray(pixels[y:y + height, x:x + width]), COMPRESSION_LEVEL))
+                      for x, y, width, height in strips if width > 0 and height > 0]
+
+    def restore(self, current):
+        if self.image is not None:
+            return self.image
+        restored = QImage(self.width, self.height, self.format)
+        pixels = image_array(restored)
+        self._write_tiles(pixels)
+        kept = self.kept_rect
+        offset_x, offset_y = kept.x() - self.crop_rect.x(), kept.y() - self.crop_rect.y()
+        current = current.convertToFormat(self.format)
+        cropped = image_array(current, writable=False)
+        pixels[kept.top():kept.bottom() + 1, kept.left():kept.right() + 1] = \
+            cropped[offset_y:offset_y + kept.height(), offset_x:offset_x + kept.width()]
+        return restored
+
+    def changed_rect(self):
+        # The strips are in the earlier image's coordinates, not the cropped one's
+        return None
+
+class SourceSnapshot(UndoSnapshot):
+    """A whole image shared by the slider commands of one run, kept for re-rendering them on undo.
+
+    It stays a QImage until spilled, when its pixels are compressed to a
+    temporary file; the next restore reads them back and holds them again.
+    cacheKey() is the original image's, so commands over one source still
+    match after a spill.
+    """
+    def __init__(self, image):
+        self._describe(image)
+        self.image = QImage(image)
+        self.key = image.cacheKey()
+        # Renders restore on worker threads while the GUI thread may be spilling
+        self.lock = threading.Lock()
+
+    def cacheKey(self):
+        return self.key
+
+    def spill(self):
+        with self.lock:
+            if self.spill_file is not None or self.image.isNull():
+                return
+            ptr = self.image.constBits()
+            ptr.setsize(self.image.sizeInBytes())
+            self.data = zlib.compress(ptr, COMPRESSION_LEVEL)
+            self.image = None
+            super().spill()
+
+    def restore(self, current=None):
+        """Return the image, reading it back from the spill file if it was spilled."""
+        with self.lock:
+            if self.image is None:
+                self.image = super().restore(current)
+                self.spill_file.close()
+                self.spill_file = None
+                self.data = None
+            return self.image
+
+class UndoStore:
+    """Keeps the undo snapshots of a command stack within a memory and a disk budget."""
+    def __init__(self, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+
+    def pack(self, command, image):
+        """Turn command's snapshot into its undo data once image, its result, is known.
+
+        Runs on the worker thread that processed the command.
+        """
+        command.packUndo(image)
+
+    def undo(self, command, undo_stack, image_label):
+        """Undo command, which has just been popped off undo_stack."""
+        command.undo()
+
+    def reset(self):
+        """Forget everything recorded for the current document."""
+
+    def _snapshots(self, undo_stack):
+        snapshots = [snapshot for snapshot in (getattr(command, "undo_snapshot", None) for command in undo_stack)
+                     if snapshot is not None]
+        # Slider commands of one run share their source, which is counted once
+        sources = {}
+        for command in undo_stack:
+            source = getattr(command, "source", None)
+            if isinstance(source, SourceSnapshot):
+                sources.setdefault(source.cacheKey(), source)
+        return snapshots + list(sources.values())
+
+    def usage(self, undo_stack):
+        """Return (memory bytes, disk bytes) used by the snapshots of undo_stack."""
+        snapshots = self._snapshots(undo_stack)
+        return (sum(snapshot.memory_bytes() for snapshot in snapshots),
+                sum(snapshot.disk_bytes() for snapshot in snapshots))
+
+    def enforce(self, undo_stack):
+        """Spill the oldest snapshots past the memory budget and drop the oldest steps past the disk budget.
+
+        undo_stack is trimmed in place, oldest command first.
+        """
+        memory, disk = self.usage(undo_stack)
+        for snapshot in self._snapshots(undo_stack):
+            if memory <= self.memory_budget:
+                break
+            in_memory, on_disk = snapshot.memory_bytes(), snapshot.disk_bytes()
+            snapshot.spill()
+            memory -= in_memory - snapshot.memory_bytes()
+            disk += snapshot.disk_bytes() - on_disk
+        while undo_stack and (memory > self.memory_budget or disk > self.disk_budget):
+            # A shared source is only freed with the last command using it, so usage is counted again
+            undo_stack.pop(0)
+            memory, disk = self.usage(undo_stack)
+
+class ReplayUndoStore(UndoStore):
+    """Undo by replaying commands from the nearest full checkpoint instead of keeping a delta per command.
+
+    Commands that would need a pixel delta keep nothing. Instead the image
+    after a command is checkpointed once CHECKPOINT_COMMANDS commands,
+    CHECKPOINT_BYTES of processed pixels or CHECKPOINT_SECONDS of measured
+    processing time have gone by since the last checkpoint. Cheap commands
+    are therefore replayed while an expensive one is checkpointed straight
+    after it, which bounds both memory and undo latency.
+    """
+    def __init__(self, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET,
+                 checkpoint_commands=CHECKPOINT_COMMANDS, checkpoint_bytes=CHECKPOINT_BYTES,
+                 checkpoint_seconds=CHECKPOINT_SECONDS):
+        super().__init__(memory_budget, disk_budget)
+        self.checkpoint_commands = checkpoint_commands
+        self.checkpoint_bytes = checkpoint_bytes
+        self.checkpoint_seconds = checkpoint_seconds
+        self.reset()
+
+    def reset(self):
+        # Without a base of its own the store replays from the label's original image
+        self.base = None
+        self.commands_since = 0
+        self.bytes_since = 0
+        self.seconds_since = 0.0
+
+    def pack(self, command, image):
+        command.packUndo(image)
+        command.checkpoint = None
+        if type(command.undo_snapshot) is UndoSnapshot:
+            command.undo_snapshot = None
+            command.replay_undo = True
+        self.commands_since += 1
+        self.bytes_since += image.sizeInBytes()
+        self.seconds_since += getattr(command, "duration", 0.0)
+        if (self.commands_since >= self.checkpoint_commands or self.bytes_since >= self.checkpoint_bytes
+                or self.seconds_since >= self.checkpoint_seconds):
+            # Compared with a null image, the snapshot keeps image whole
+            command.checkpoint = UndoSnapshot(image, QImage())
+            self.commands_since = 0
+            self.bytes_since = 0
+            self.seconds_since = 0.0
+
+    def undo(self, command, undo_stack, image_label):
+        command.checkpoint = None
+        if not getattr(command, "replay_undo", False):
+            command.undo()
+            return
+        command.replay_undo = False
+        image_label.showImage(self.replay(undo_stack, image_label))
+
+    def replay(self, undo_stack, image_label):
+        """Rebuild the image after the last command of undo_stack from the nearest checkpoint."""
+        start = 0
+        image = self.base.restore(None) if self.base is not None else image_label.original_image
+        for index in range(len(undo_stack) - 1, -1, -1):
+            checkpoint = getattr(undo_stack[index], "checkpoint", None)
+            if checkpoint is not None:
+                start = index + 1
+                image = checkpoint.restore(None)
+                break
+        for command in undo_stack[start:]:
+            if hasattr(command, "process"):
+                image = command.process(image)
+        return image
+
+    def _snapshots(self, undo_stack):
+        checkpoints = [getattr(command, "checkpoint", None) for command in undo_stack] + [self.base]
+        return super()._snapshots(undo_stack) + [checkpoint for checkpoint in checkpoints if checkpoint is not None]
+
+    def enforce(self, undo_stack):
+        """Spill the oldest checkpoints past the memory budget, then drop history up to a checkpoint past either budget.
+
+        The dropped commands' last checkpoint becomes the new replay base.
+        """
+        memory, disk = self.usage(undo_stack)
+        for snapshot in self._snapshots(undo_stack):
+            if memory <= self.memory_budget:
+                break
+            in_memory, on_disk = snapshot.memory_bytes(), snapshot.disk_bytes()
+            snapshot.spill()
+            memory -= in_memory - snapshot.memory_bytes()
+            disk += snapshot.disk_bytes() - on_disk
+        while memory > self.memory_budget or disk > self.disk_budget:
+            oldest = next((index for index, command in enumerate(undo_stack)
+                           if getattr(command, "checkpoint", None) is not None), None)
+            if oldest is None or oldest == len(undo_stack) - 1:
+                # Keep at least the checkpoint the latest undo replays from
+                break
+            self.base = undo_stack[oldest].checkpoint
+            del undo_stack[:oldest + 1]
+            memory, disk = self.usage(undo_stack)
@@ -0,0 +1,97 @@
+# src/workers.py
+import time
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+from PyQt5.QtGui import QImage
+from .recipes import apply_recipe
+
+class Cancelled(Exception):
+    """Raised inside a worker's progress callback once it has been cancelled."""
+
+class WorkerSignals(QObject):
+    """Signals of a CommandWorker, delivered on the GUI thread."""
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(object)
+    packed = pyqtSignal()
+    failed = pyqtSignal(str)
+
+class CommandWorker(QRunnable):
+    """Runs command.process() on a snapshot of the image in a thread pool, then packs its undo data.
+
+    finished carries the result as soon as it is computed, so it can be shown
+    while pack(command, result), by default command.packUndo(result), runs;
+    packed follows once the command can be undone. The time process() took
+    is left in command.duration.
+    """
+    def __init__(self, command, snapshot, pack=None):
+        super().__init__()
+        self.command = command
+        self.snapshot = snapshot
+        self.pack = pack if pack is not None else (lambda command, image: command.packUndo(image))
+        self.cancelled = False
+        self.signals = WorkerSignals()
+
+    def cancel(self):
+        """Stop at the next progress report and drop the result."""
+        self.cancelled = True
+
+    def reportProgress(self, done, total):
+        if self.cancelled:
+            raise Cancelled()
+        self.signals.progress.emit(int(100 * done / total))
+
+    def run(self):
+        try:
+            started = time.perf_counter()
+            result = self.command.process(self.snapshot, self.reportProgress)
+            self.command.duration = time.perf_counter() - started
+        except Cancelled:
+            return
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        if self.cancelled:
+            return
+        self.signals.finished.emit(result)
+        try:
+            self.pack(self.command, result)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        # Let go of the result first, so the next edit finds its pixels unshared and can patch them in place
+        del result
+        if not self.cancelled:
+            self.signals.packed.emit()
+
+class FileSignals(QObject):
+    """Signals of a FileRecipeWorker, delivered on the GUI thread."""
+    finished = pyqtSignal(str, str, str)  # source, target, error message ("" on success)
+
+class FileRecipeWorker(QRunnable):
+    """Opens one file, applies a recipe to it and saves the result, in a thread pool."""
+    def __init__(self, source, target, recipe):
+        super().__init__()
+        self.source = source
+        self.target = target
+        self.recipe = recipe
+        self.cancelled = False
+        self.signals = FileSignals()
+
+    def cancel(self):
+        """Skip the file if it has not been started yet."""
+        self.cancelled = True
+
+    def run(self):
+        if self.cancelled:
+            self.signals.finished.emit(self.source, self.target, "cancelled")
+            return
+        try:
+            image = QImage(self.source)
+            if image.isNull():
+                error = "unable to open image"
+            elif not apply_recipe(image, self.recipe).save(self.target):
+                error = "unable to save image"
+            else:
+                error = ""
+        except Exception as e:
+            error = str(e)
+        self.signals.finished.emit(self.source, self.target, error)
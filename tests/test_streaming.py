@@ -0,0 +1,53 @@
+# tests/test_streaming.py
+import numpy as np
+from PyQt5.QtGui import QColor, QImage
+from src.pixels import image_array
+from src.recipes import apply_recipe
+from src.streaming import stream_recipe
+
+RECIPE = {"version": 1, "steps": [{"op": "sepia"}, {"op": "brightness", "value": 20},
+                                  {"op": "adjust", "brightness": 5, "contrast": 10, "hue": 40}]}
+
+def _pixels(path):
+    image = QImage(path).convertToFormat(QImage.Format_ARGB32)
+    return image_array(image, writable=False).copy()
+
+def _expected(path):
+    image = apply_recipe(QImage(path), RECIPE).convertToFormat(QImage.Format_ARGB32)
+    return image_array(image, writable=False).copy()
+
+def _gradient(width, height):
+    image = QImage(width, height, QImage.Format_ARGB32)
+    rows, columns = np.mgrid[0:height, 0:width]
+    pixels = image_array(image)
+    pixels[..., 0] = columns * 7 % 256
+    pixels[..., 1] = rows * 5 % 256
+    pixels[..., 2] = (rows + columns) % 256
+    pixels[..., 3] = (rows * 3 + columns) % 256
+    return image
+
+def test_rgba_png_keeps_alpha(tmp_path):
+    source, target = str(tmp_path / "in.png"), str(tmp_path / "out.png")
+    assert _gradient(97, 61).save(source)
+    stream_recipe(source, target, RECIPE, strip_bytes=4096)
+    assert QImage(target).hasAlphaChannel()
+    assert np.array_equal(_pixels(target), _expected(source))
+
+def test_palette_png_keeps_transparency(tmp_path):
+    source, target = str(tmp_path / "in.png"), str(tmp_path / "out.png")
+    image = QImage(40, 30, QImage.Format_Indexed8)
+    image.setColorTable([QColor(200, 10, 10, 0).rgba(), QColor(10, 200, 10, 128).rgba(), QColor(10, 10, 200).rgba()])
+    indices = np.arange(40 * 30).reshape(30, 40) % 3
+    for y in range(30):
+        for x in range(40):
+            image.setPixel(x, y, int(indices[y, x]))
+    assert image.save(source)
+    stream_recipe(source, target, RECIPE, strip_bytes=1024)
+    assert np.array_equal(_pixels(target), _expected(source))
+
+def test_opaque_png_stays_rgb(tmp_path):
+    source, target = str(tmp_path / "in.png"), str(tmp_path / "out.png")
+    assert _gradient(50, 20).convertToFormat(QImage.Format_RGB32).save(source)
+    stream_recipe(source, target, RECIPE, strip_bytes=2048)
+    assert not QImage(target).hasAlphaChannel()
+    assert np.array_equal(_pixels(target), _expected(source))